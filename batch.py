@@ -0,0 +1,193 @@
+#/usr/bin/env python
+#
+# ------------------------------------------------------------------------------
+# Copyright (c) 2012, Matt Davis  <matt@synclab.org>
+# Copyright (c) 2012, Julien Ridoux <julien@synclab.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ------------------------------------------------------------------------------
+
+"""
+Batch reports for a fleet of hosts. The manifest lists one host per line:
+
+    host radclock_file stamps_file
+
+where stamps_file is the RAD_merged output of dag_extract. Empty lines and
+lines starting with '#' are ignored. Each host is loaded, merged, summarised
+and plotted in its own worker process, producing <host>_<metric>_tseries.png,
+<host>_<metric>_hist.png and <host>_stats.csv in the output directory.
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+# Headless rendering in workers, must be set before importing pyplot
+import matplotlib
+matplotlib.use('Agg')
+import pandas as pd
+
+from munger import DataLoader, DataMerger, DataContainer
+from plots import tseries, hist, allanvar, Renderer
+from plots.common import custom_stats
+
+
+STAGES = ('load', 'merge', 'stats', 'plot')
+METRICS = ('rtt', 'rtt_host', 'server_delay')
+
+
+def read_manifest(manifest):
+    """
+    Parse manifest file into a list of (host, radclock_file, stamps_file).
+    """
+    jobs = list()
+    with open(manifest, 'r') as fdesc:
+        for line in fdesc:
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            tokens = line.split()
+            if len(tokens) != 3:
+                print 'Malformed manifest line: ' + line
+                raise ValueError
+            jobs.append(tuple(tokens))
+    return jobs
+
+
+
+def process_host(host, radclock_file, stamps_file, outdir,
+                 ptile_range=(1, 99), allan=None):
+    """
+    Run load, merge, stats and plot stages for one host. Returns host and the
+    time spent in each stage (seconds).
+    """
+    timings = dict()
+
+    start = time.time()
+    radclock = DataContainer('radclock')
+    DataLoader.load(radclock_file, radclock, fast=True)
+    stamps = DataContainer('RAD_merged')
+    DataLoader.load(stamps_file, stamps, fast=True)
+    timings['load'] = time.time() - start
+
+    start = time.time()
+    merged = DataMerger.merge(radclock, stamps)
+    timings['merge'] = time.time() - start
+
+    start = time.time()
+    metrics = merged.metrics(METRICS)
+    stats = custom_stats(metrics, ptile_range)
+    stats.to_csv(os.path.join(outdir, host + '_stats.csv'))
+    timings['stats'] = time.time() - start
+
+    start = time.time()
+    prefix = os.path.join(outdir, host + '_')
+    # Hosts already run in parallel, save in this process
+    renderer = Renderer(workers=0)
+    for name in METRICS:
+        renderer.render(prefix + name + '_tseries.png', tseries,
+                        metrics[name], title=host + ' ' + name, ylabel=name,
+                        ptile_range=ptile_range, fast=True)
+        renderer.render(prefix + name + '_hist.png', hist, metrics[name],
+                        title=host + ' ' + name, xlabel=name,
+                        ptile_range=ptile_range)
+    if allan is not None:
+        renderer.render(prefix + allan + '_allanvar.png', allanvar,
+                        metrics[allan], title=host + ' ' + allan)
+    renderer.close()
+    timings['plot'] = time.time() - start
+
+    return host, timings
+
+
+
+def run_job(job):
+    """
+    process_host() in a worker, failures are returned rather than raised so
+    other hosts go on. Returns host, timings (None on failure) and error.
+    """
+    try:
+        host, timings = process_host(*job)
+        return host, timings, None
+    except Exception as e:
+        return job[0], None, '%s: %s' % (type(e).__name__, e)
+
+
+
+def run(jobs, outdir, workers=None, ptile_range=(1, 99), allan=None):
+    """
+    Fan hosts out across a process pool. Returns a DataFrame of stage timings
+    indexed by host, and the list of hosts that failed.
+    """
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    timings = dict()
+    failed = list()
+    pool = multiprocessing.Pool(processes=workers)
+    args = [(host, radclock_file, stamps_file, outdir, ptile_range, allan)
+            for host, radclock_file, stamps_file in jobs]
+    for host, host_timings, error in pool.imap_unordered(run_job, args):
+        if error is None:
+            timings[host] = host_timings
+            print '%s done in %.1fs' % (host, sum(host_timings.values()))
+        else:
+            failed.append(host)
+            print 'ERROR: %s failed: %s' % (host, error)
+    pool.close()
+    pool.join()
+
+    return pd.DataFrame(timings, index=STAGES).T, failed
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('manifest', help='manifest of host and data files')
+    parser.add_argument('-o', '--outdir', default='.',
+                        help='output directory')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: #cores)')
+    parser.add_argument('--allan', choices=METRICS, default=None,
+                        help='also plot Allan deviation of this metric')
+    args = parser.parse_args()
+
+    start = time.time()
+    timings, failed = run(read_manifest(args.manifest), args.outdir,
+                          args.jobs, allan=args.allan)
+    print
+    print timings.to_string(float_format=lambda x: '%.2f' % x)
+    print 'Total (wall clock): %.1fs' % (time.time() - start)
+
+    # Non-zero exit status for cron and other schedulers
+    if failed:
+        print 'Failed hosts: ' + ' '.join(sorted(failed))
+        return 1
+    return 0
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+#/usr/bin/env python
+#
+# ------------------------------------------------------------------------------
+# Copyright (c) 2012, Matt Davis  <matt@synclab.org>
+# Copyright (c) 2012, Julien Ridoux <julien@synclab.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ------------------------------------------------------------------------------
+
+"""
+Time compute_allanvar() on random series of 1e4 to 1e7 samples, at octaves
+and on a log-spaced grid, overlapping (smoothed) or not. The brute-force
+implementation of tests/test_allanvar.py is timed on the smallest size for
+reference. Run from the top directory:
+
+    python bench/bench_allanvar.py [--sizes 10000 100000 ...]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+# Top directory for the packages, tests for the reference implementation
+TOP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [TOP, os.path.join(TOP, 'tests')]
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import pandas as pd
+
+from plots.allanvar import compute_allanvar, log_timescales
+from test_allanvar import random_clock, reference_allanvar
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10**4, 10**5, 10**6, 10**7])
+    args = parser.parse_args()
+
+    rows = list()
+    for size in args.sizes:
+        values = random_clock(size)
+        for smoothed in (True, False):
+            grid = log_timescales(size, 20, smoothed)
+            octaves, (timescales, variances) = timed(compute_allanvar, values,
+                                                     smoothed)
+            logspaced, result = timed(compute_allanvar, values, smoothed, grid)
+            row = {'size': size, 'smoothed': smoothed,
+                   'octaves': len(timescales), 'octaves_s': octaves,
+                   'log_grid': len(grid), 'log_grid_s': logspaced}
+
+            if size == min(args.sizes):
+                brute, expected = timed(lambda: [reference_allanvar(values, m,
+                                                                    smoothed)
+                                                 for m in timescales])
+                row['brute_s'] = brute
+                row['max_rel_error'] = np.max(np.abs(variances - expected) /
+                                              np.abs(expected))
+            rows.append(row)
+
+    columns = ['size', 'smoothed', 'octaves', 'octaves_s', 'log_grid',
+               'log_grid_s', 'brute_s', 'max_rel_error']
+    print pd.DataFrame(rows, columns=columns).to_string(index=False,
+                                                        na_rep='-')
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+#/usr/bin/env python
+#
+# ------------------------------------------------------------------------------
+# Copyright (c) 2012, Matt Davis  <matt@synclab.org>
+# Copyright (c) 2012, Julien Ridoux <julien@synclab.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ------------------------------------------------------------------------------
+
+"""
+Time DataMerger.merge() of radclock data with RAD_merged stamps against the
+former hash join (munger/munger.py), on synthetic containers of 10M rows by
+default. Both outputs are checked to hold the same rows. Run from the top
+directory:
+
+    python bench/bench_merge.py [--rows 10000000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+import numpy as np
+import pandas as pd
+
+from munger import DataMerger, DataContainer
+from munger.munger import DataMerger as HashMerger
+
+
+RADCLOCK_FIELDS = ['Ta', 'Tb', 'Te', 'Tf', 'RTT', 'phat', 'DAG_RX', 'DAG_TX']
+STAMPS_FIELDS = ['Ta', 'Tb', 'Tf', 'Tout', 'DAG_RX', 'DAG_TX']
+
+
+def make_containers(rows, seed=0):
+    """
+    radclock and RAD_merged containers sorted on Tf, with one stamp in ten
+    missing on the RAD_merged side. Columns are added one by one (see
+    DataCache.fetch()).
+    """
+    random = np.random.RandomState(seed)
+    keys = np.uint64(18 * 10**18) + np.cumsum(random.randint(1, 1000, rows)
+                                              ).astype(np.uint64)
+    stamps = 1349061234 + np.arange(rows) * 16.0
+
+    radclock = DataContainer('radclock')
+    data = pd.DataFrame(index=pd.RangeIndex(rows))
+    data['time'] = pd.to_datetime((stamps * 1e9).astype(np.int64), utc=True)
+    for name in RADCLOCK_FIELDS:
+        data[name] = random.rand(rows)
+    data['Ta'] = keys - np.uint64(500)
+    data['Tf'] = keys
+    radclock.data = data
+    radclock.fields = list(RADCLOCK_FIELDS)
+
+    keep = np.flatnonzero(random.rand(rows) > 0.1)
+    merged = DataContainer('RAD_merged')
+    data = pd.DataFrame(index=pd.RangeIndex(len(keep)))
+    data['time'] = radclock.data['time'].values[keep]
+    for name in STAMPS_FIELDS:
+        data[name] = random.rand(len(keep))
+    data['Tf'] = keys[keep]
+    merged.data = data
+    merged.fields = list(STAMPS_FIELDS)
+    return radclock, merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10**7)
+    args = parser.parse_args()
+
+    radclock, stamps = make_containers(args.rows)
+    start = time.time()
+    merged = DataMerger.merge(radclock, stamps)
+    sorted_time = time.time() - start
+    sorted_keys = merged.data['Tf'].values
+    del merged
+
+    # The hash join modifies its inputs
+    radclock, stamps = make_containers(args.rows)
+    start = time.time()
+    hashed = HashMerger.merge_radclock(radclock, stamps)
+    hash_time = time.time() - start
+
+    same = np.array_equal(np.sort(sorted_keys), np.sort(hashed['Tf'].values))
+    print '%d rows, %d merged' % (args.rows, len(sorted_keys))
+    print 'hash join:   %.2fs' % hash_time
+    print 'sorted join: %.2fs (%.1fx)' % (sorted_time, hash_time / sorted_time)
+    print 'same rows:   %s' % same
+    return 0 if same else 1
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
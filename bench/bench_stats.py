@@ -0,0 +1,99 @@
+#/usr/bin/env python
+#
+# ------------------------------------------------------------------------------
+# Copyright (c) 2012, Matt Davis  <matt@synclab.org>
+# Copyright (c) 2012, Julien Ridoux <julien@synclab.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ------------------------------------------------------------------------------
+
+"""
+Time custom_stats() on a Series of 1e8 rows by default, against the former
+describe() plus four quantile() calls. Both are checked to give the same
+stats. Run from the top directory:
+
+    python bench/bench_stats.py [--rows 100000000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import pandas as pd
+
+from plots.common import custom_stats
+
+
+def describe_stats(data, ptile_range):
+    """
+    Former custom_stats() of a Series: each quantile() partitions the data
+    again.
+    """
+    stats = data.describe()
+    return pd.concat([
+        stats,
+        pd.Series(data.quantile(q=1/100.0), index=['1%']),
+        pd.Series(data.quantile(q=99/100.0), index=['99%']),
+        pd.Series(data.quantile(q=ptile_range[0]/100.0),
+                  index=['lower_bound']),
+        pd.Series(data.quantile(q=ptile_range[1]/100.0),
+                  index=['upper_bound']),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10**8)
+    args = parser.parse_args()
+
+    random = np.random.RandomState(0)
+    data = pd.Series(random.lognormal(size=args.rows) * 1e-3, name='rtt')
+    data.values[::1000] = np.nan
+    ptile_range = (2, 98)
+
+    start = time.time()
+    stats = custom_stats(data, ptile_range)
+    fused = time.time() - start
+
+    start = time.time()
+    expected = describe_stats(data, ptile_range)
+    former = time.time() - start
+
+    same = np.allclose(stats[expected.index].values, expected.values,
+                       rtol=1e-9)
+    print '%d rows' % args.rows
+    print 'describe + quantiles: %.2fs' % former
+    print 'custom_stats:         %.2fs (%.1fx)' % (fused, former / fused)
+    print 'same stats:           %s' % same
+    return 0 if same else 1
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
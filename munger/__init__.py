@@ -30,3 +30,4 @@
 from loader import DataLoader
 from merger import DataMerger
 from container import DataContainer
+from cache import DataCache
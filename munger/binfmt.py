@@ -0,0 +1,171 @@
+#/usr/bin/env python
+#
+# ------------------------------------------------------------------------------
+# Copyright (c) 2012, Matt Davis  <matt@synclab.org>
+# Copyright (c) 2012, Julien Ridoux <julien@synclab.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ------------------------------------------------------------------------------
+
+import exceptions
+import os
+import numpy as np
+import pandas as pd
+
+
+# Binary stamp files keep the text header (description, type, version, magic,
+# fields) and add the record types and a last header line giving the offset of
+# the first record:
+#
+#   % fields: Ta Tb Te Tf RTT stamp phat
+#   % dtypes: <u8 <f8 <f8 <u8 <f8 <i8 <f8
+#   % format: binary 00000256
+#
+# Records are fixed width, in the order of fields, with the timestamp (field 5)
+# as int64 nanoseconds since epoch. Padding up to the offset is ignored.
+BINARY_MARKER = '% format: binary'
+ALIGN = 64
+
+
+def is_binary(path):
+    """
+    True if path is a binary stamp file.
+    """
+    fdesc = open(path, 'rb')
+    head = fdesc.read(1 << 16)
+    fdesc.close()
+    return ('\n' + BINARY_MARKER) in head
+
+
+def record_dtype(fields, dtypes):
+    """
+    numpy record type from fields names and list of their types.
+    """
+    return np.dtype([(str(f), np.dtype(t)) for f, t in zip(fields, dtypes)])
+
+
+def data_dtypes(data, fields):
+    """
+    Record field types matching parsed data (as returned by
+    DataLoader.iter_table()). Only numeric fields fit in fixed width records.
+    """
+    dtypes = list()
+    for i, field in enumerate(fields):
+        if i == 5:
+            dtypes.append(np.dtype('<i8'))
+        elif data[field].dtype.kind in 'uif':
+            dtypes.append(data[field].dtype.newbyteorder('<'))
+        else:
+            print 'Cannot store field %s of type %s in binary records' % (
+                    field, data[field].dtype)
+            raise exceptions.TypeError
+    return dtypes
+
+
+def write_header(fdesc, header_info, dtypes):
+    """
+    Write text header for records of types dtypes, padded so records start on
+    an ALIGN boundary. Returns the offset of the first record.
+    """
+    fields = header_info['fields']
+    lines = list()
+    lines.append('%% description: %s\n' % header_info['description'])
+    lines.append('%% type: %s\n' % header_info['mtype'])
+    lines.append('%% version: %d\n' % header_info['version'])
+    lines.append('%% magic: %s\n' % header_info['magic'])
+    lines.append('%% fields: %s\n' % ' '.join(fields))
+    lines.append('%% dtypes: %s\n' % ' '.join(np.dtype(t).str for t in dtypes))
+    header = ''.join(lines)
+
+    last = '%s %08d\n' % (BINARY_MARKER, 0)
+    offset = -(-(len(header) + len(last)) // ALIGN) * ALIGN
+    fdesc.write(header)
+    fdesc.write('%s %08d\n' % (BINARY_MARKER, offset))
+    fdesc.write('\0' * (offset - len(header) - len(last)))
+    return offset
+
+
+def write_records(fdesc, data, fields, dtype):
+    """
+    Append rows of data (as returned by DataLoader.iter_table()) as records of
+    type dtype. The timestamp field is taken from the 'time' column to keep
+    nanoseconds. Columns that do not fit their record type without loss are
+    rejected.
+    """
+    records = np.empty(len(data), dtype=dtype)
+    for i, field in enumerate(fields):
+        if i == 5:
+            records[field] = data['time'].values.view(np.int64)
+            continue
+        values = data[field].values
+        if not np.can_cast(values.dtype, dtype[field], 'safe'):
+            print 'Cannot store field %s of type %s as %s' % (
+                    field, values.dtype, dtype[field])
+            raise exceptions.TypeError
+        records[field] = values
+    fdesc.write(records.tobytes())
+
+
+def open_records(path, header_info):
+    """
+    Memory map the records of a binary stamp file (read only). A partial
+    record at the end of the file (being written) is ignored.
+    """
+    dtype = record_dtype(header_info['fields'], header_info['dtypes'])
+    offset = header_info['offset']
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+    if count <= 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset,
+                     shape=(count,))
+
+
+def records_frame(records, fields, start=0, schema=None):
+    """
+    DataFrame of records with the same layout as the text parsers ('time'
+    column first, index is the row number, start being the row number of the
+    first record). Each column is copied out of records (pandas consolidates
+    columns in its own blocks), only the time field is converted.
+    """
+    schema = schema or dict()
+    data = pd.DataFrame(index=pd.RangeIndex(start, start + len(records)))
+    data['time'] = pd.to_datetime(records[fields[5]], utc=True)
+    for i, field in enumerate(fields):
+        if schema.get(field) == 'drop':
+            continue
+        if i == 5:
+            data[field] = records[field] * 1e-9
+        else:
+            data[field] = records[field]
+    return data
+
+
+def to_ns(t):
+    """
+    Time t as int64 nanoseconds since epoch. t is a UNIX timestamp in seconds
+    or anything pandas.Timestamp understands (naive times are UTC).
+    """
+    if isinstance(t, (int, long, np.integer)):
+        return int(t) * 10**9
+    if isinstance(t, (float, np.floating)):
+        return int(round(t * 1e9))
+    return pd.Timestamp(t).value
@@ -0,0 +1,217 @@
+#/usr/bin/env python
+#
+# ------------------------------------------------------------------------------
+# Copyright (c) 2012, Matt Davis  <matt@synclab.org>
+# Copyright (c) 2012, Julien Ridoux <julien@synclab.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ------------------------------------------------------------------------------
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import pandas as pd
+import numpy as np
+
+
+class DataCache(object):
+    """
+    On-disk cache of parsed stamp files. Each entry is a directory holding one
+    .npy file per column and a json file with the header info. A hit is a
+    binary read of the columns plus one copy into the DataFrame (pandas owns
+    its blocks): no parsing, but the frame is not backed by the files. Entries
+    are keyed by file path, size, mtime and a hash of the beginning and end of
+    the file, so they are invalidated when the file changes. The least
+    recently used entries are evicted when the cache grows over max_size
+    bytes.
+    Cache directory defaults to $RADCLOCK_PLOTS_CACHE or
+    ~/.cache/radclock-plots.
+    """
+
+    HASH_BLOCK = 1 << 20
+
+    def __init__(self, cache_dir=None, max_size=4 << 30):
+        if cache_dir is None:
+            cache_dir = os.environ.get('RADCLOCK_PLOTS_CACHE',
+                    os.path.join(os.path.expanduser('~'), '.cache',
+                                 'radclock-plots'))
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+
+    def key(self, path, variant=''):
+        """
+        Cache key for data file path. variant distinguishes different ways of
+        parsing the same file.
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        digest = hashlib.md5()
+        digest.update(('%s %d %r %s' % (path, st.st_size, st.st_mtime,
+                                        variant)).encode('utf-8'))
+
+        # Hash of content, limited to both ends of the file to keep it cheap
+        fdesc = open(path, 'rb')
+        digest.update(fdesc.read(self.HASH_BLOCK))
+        if st.st_size > self.HASH_BLOCK:
+            fdesc.seek(max(st.st_size - self.HASH_BLOCK, self.HASH_BLOCK))
+            digest.update(fdesc.read())
+        fdesc.close()
+        return digest.hexdigest()
+
+
+    def fetch(self, path, variant=''):
+        """
+        Return (header_info, data) for path, or None if not cached.
+        """
+        entry = os.path.join(self.cache_dir, self.key(path, variant))
+        if not os.path.isdir(entry):
+            return None
+
+        fdesc = open(os.path.join(entry, 'meta.json'), 'r')
+        meta = json.load(fdesc)
+        fdesc.close()
+
+        # Columns are added one by one: building the DataFrame from a dict
+        # boxes every stamp of tz aware columns
+        if meta.get('range_index'):
+            start, stop, step = meta['range_index']
+            index = pd.RangeIndex(start, stop, step)
+        else:
+            index = np.load(os.path.join(entry, 'index.npy'))
+        data = pd.DataFrame(index=index)
+        for i, col in enumerate(meta['columns']):
+            values = np.load(os.path.join(entry, '%d.npy' % i), mmap_mode='r')
+            if col['kind'] == 'datetime':
+                values = pd.to_datetime(values, utc=col['utc'])
+            elif col['kind'] == 'category':
+                values = pd.Categorical.from_codes(values,
+                            np.asarray(col['categories']).astype(object))
+            elif col['kind'] == 'string':
+                values = values.astype(str).astype(object)
+            else:
+                # Read from the memory map when pandas copies the column in
+                values = np.asarray(values)
+            data[col['name']] = values
+
+        # Used as LRU clock
+        os.utime(entry, None)
+        return meta['header_info'], data
+
+
+    def store(self, path, header_info, data, variant=''):
+        """
+        Cache parsed data and header_info for path, and evict old entries if
+        needed.
+        """
+        key = self.key(path, variant)
+        tmp = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-')
+
+        columns = list()
+        # A RangeIndex is stored as start, stop and step (possibly empty)
+        range_index = None
+        if isinstance(data.index, pd.RangeIndex):
+            range_index = [0, 0, 1]
+            if len(data.index) > 0:
+                step = 1
+                if len(data.index) > 1:
+                    step = int(data.index[1] - data.index[0])
+                range_index = [int(data.index[0]),
+                               int(data.index[-1]) + step, step]
+        else:
+            np.save(os.path.join(tmp, 'index.npy'), np.asarray(data.index))
+        for i, name in enumerate(data.columns):
+            col = data[name]
+            kind = 'array'
+            utc = False
+            categories = None
+            if hasattr(col, 'cat'):
+                kind = 'category'
+                categories = [str(c) for c in col.cat.categories]
+                values = col.cat.codes.values
+            elif str(col.dtype).startswith('datetime64'):
+                kind = 'datetime'
+                utc = getattr(col.dt, 'tz', None) is not None
+                values = col.values.view(np.int64)
+            elif col.dtype == object:
+                kind = 'string'
+                values = np.asarray(col.values, dtype='S')
+            else:
+                values = col.values
+            np.save(os.path.join(tmp, '%d.npy' % i), values)
+            columns.append({'name': name, 'kind': kind, 'utc': utc,
+                            'categories': categories})
+
+        fdesc = open(os.path.join(tmp, 'meta.json'), 'w')
+        json.dump({'header_info': header_info, 'columns': columns,
+                   'range_index': range_index}, fdesc)
+        fdesc.close()
+
+        entry = os.path.join(self.cache_dir, key)
+        if os.path.isdir(entry):
+            shutil.rmtree(tmp)
+        else:
+            os.rename(tmp, entry)
+        self.evict()
+
+
+    def entries(self):
+        """
+        List of (last access, size, path) for all cache entries.
+        """
+        entries = list()
+        for name in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, name)
+            if name.startswith('.') or not os.path.isdir(entry):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, f))
+                       for f in os.listdir(entry))
+            entries.append((os.path.getmtime(entry), size, entry))
+        return entries
+
+
+    def size(self):
+        return sum(size for atime, size, entry in self.entries())
+
+
+    def evict(self):
+        """
+        Remove least recently used entries until cache fits in max_size.
+        """
+        entries = sorted(self.entries())
+        total = sum(size for atime, size, entry in entries)
+        while entries and total > self.max_size:
+            atime, size, entry = entries.pop(0)
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+
+    def clear(self):
+        """
+        Remove all cache entries.
+        """
+        for atime, size, entry in self.entries():
+            shutil.rmtree(entry, ignore_errors=True)
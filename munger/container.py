@@ -48,12 +48,20 @@ class DataContainer(object):
             }
 
 
+    # Derived metrics, name -> function(container) returning a Series. Use
+    # register_metric() to add some, the registry of a class is inherited by
+    # its subclasses.
+    metricsRegistry = dict()
+
+
     def __init__(self, mtype=None):
         """
         Generic class to open stamp data files. Main purpose of the constructor is
         to extract header and data from files created by radclock, dag_extract or
         udp_probes_sniffer.
         """
+        self._metrics = dict()
+        self._metrics_key = None
         self.data = pd.DataFrame()
         self.fields = list()
 
@@ -64,30 +72,97 @@ class DataContainer(object):
             self.mtype = mtype
 
 
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        # New data, cached metrics are stale
+        self._data = data
+        self.invalidate()
+
+
+    def invalidate(self):
+        """
+        Drop cached metrics. Needed if values of data are modified in place,
+        replacing data or changing its shape is detected.
+        """
+        self._metrics = dict()
+        self._metrics_key = None
+
+
+    @classmethod
+    def register_metric(cls, name, func):
+        """
+        Register derived metric name for this class (and subclasses), computed
+        by func(container) as a Series. func can use other metrics through
+        container.metric(), which are then computed only once. For example:
+
+        DataRadclock.register_metric('rtt_ms', lambda c: c.metric('rtt') * 1e3)
+        """
+        if 'metricsRegistry' not in cls.__dict__:
+            cls.metricsRegistry = dict(cls.metricsRegistry)
+        cls.metricsRegistry[name] = func
+
+
+    def metric(self, name):
+        """
+        Derived metric name as a Series, computed on first call and cached
+        until data changes. The Series is shared, do not modify it.
+        """
+        key = (id(self._data), self._data.shape)
+        if key != self._metrics_key:
+            self._metrics = dict()
+            self._metrics_key = key
+
+        if name not in self._metrics:
+            if name not in self.metricsRegistry:
+                print 'Unknown metric %s' % name
+                raise exceptions.KeyError
+            s = self.metricsRegistry[name](self)
+            self._metrics[name] = pd.Series(s.values, index=s.index,
+                                            name=name)
+        return self._metrics[name]
+
+
+    def metrics(self, names):
+        """
+        DataFrame of several derived metrics. Intermediate metrics are shared
+        (eg. rtt is computed once for rtt and rtt_host).
+        """
+        return pd.concat([self.metric(name) for name in names], axis=1)
+
+
+    def memory_usage(self):
+        """
+        Memory used by data in bytes, per column (with the index and strings
+        counted), plus cached metrics as 'metrics'.
+        """
+        usage = self._data.memory_usage(index=True, deep=True)
+        usage['metrics'] = sum(s.memory_usage(index=False, deep=True)
+                               for s in self._metrics.values())
+        return usage
+
+
 
 class DataRadclock(DataContainer):
 
     def raw_rtt(self):
-        df = self.data
-        s = df.RTT
-        s.name = 'raw_rtt'
-        return s
+        return self.metric('raw_rtt')
 
     def rtt(self):
-        df = self.data
-        s = df.RTT * df.phat
-        s.name = 'rtt'
-        return s
+        return self.metric('rtt')
 
     def rtt_host(self):
-        df = self.data
-        s = df.RTT * df.phat - (df.DAG_RX - df.DAG_TX)
-        s.name = 'rtt_host'
-        return s
+        return self.metric('rtt_host')
 
     def server_delay(self):
-        df = self.data
-        s = df.Te - df.Tb
-        s.name = 'server_delay'
-        return s
+        return self.metric('server_delay')
+
 
+DataRadclock.register_metric('raw_rtt', lambda c: c.data.RTT)
+DataRadclock.register_metric('rtt', lambda c: c.data.RTT * c.data.phat)
+DataRadclock.register_metric('rtt_host',
+        lambda c: c.metric('rtt') - (c.data.DAG_RX - c.data.DAG_TX))
+DataRadclock.register_metric('server_delay', lambda c: c.data.Te - c.data.Tb)
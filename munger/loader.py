@@ -27,14 +27,20 @@
 # ------------------------------------------------------------------------------
 
 import exceptions
+import os
 import re
 import pandas as pd
 import numpy as np
 
+from StringIO import StringIO
 from datetime import datetime as dtime
 from dateutil import tz
 
+from binfmt import *
+from cache import DataCache
 from container import *
+from schema import get_schema, apply_schema
+from stampindex import StampIndex
 
 
 # Took a while to get it right (right being relative to pandas and numpy
@@ -46,6 +52,102 @@ def stamp_parser(stamp):
     return dtime.utcfromtimestamp(np.float64(stamp)).replace(tzinfo=tz.tzutc())
 
 
+def stamps_to_ns(stamps):
+    """
+    Vectorized conversion of UNIX stamps written as decimal strings (eg.
+    '1349061234.123456789') to int64 nanoseconds since epoch. Goes through the
+    characters of all stamps at once, one column at a time, so the full
+    precision is kept (a float64 would lose the last digits). Digits beyond the
+    nanosecond are ignored.
+    """
+    stamps = np.asarray(stamps, dtype='S')
+    width = stamps.dtype.itemsize
+    chars = stamps.view(np.uint8).reshape(len(stamps), width)
+
+    seconds = np.zeros(len(stamps), dtype=np.int64)
+    nanos = np.zeros(len(stamps), dtype=np.int64)
+    ndigits = np.zeros(len(stamps), dtype=np.int64)
+    in_frac = np.zeros(len(stamps), dtype=bool)
+    for i in range(width):
+        c = chars[:, i].astype(np.int64)
+        digit = c - ord('0')
+        is_digit = (digit >= 0) & (digit <= 9)
+        in_frac |= (c == ord('.'))
+        in_int = is_digit & ~in_frac
+        seconds = np.where(in_int, seconds * 10 + digit, seconds)
+        in_ns = is_digit & in_frac & (ndigits < 9)
+        nanos = np.where(in_ns, nanos * 10 + digit, nanos)
+        ndigits += in_ns
+    return seconds * 10**9 + nanos * 10**(9 - ndigits)
+
+
+# Raw counters and NTP keys, using the full unsigned 64 bit range
+UNSIGNED_FIELDS = ('Ta', 'Tf')
+
+
+def sniff_dtypes(line, fields, schema=None):
+    """
+    Guess column types from a line of data. Integers are read as int64, or
+    uint64 for raw counters (UNSIGNED_FIELDS and uint64 fields of schema):
+    only the first line is looked at, and a negative value in a later row
+    would silently wrap in an unsigned column. Anything else is read as
+    float64. Timestamps (field 5) are kept as strings for stamps_to_ns().
+    """
+    if schema is None:
+        schema = dict()
+    dtypes = dict()
+    for i, (field, token) in enumerate(zip(fields, line.split())):
+        if i == 5:
+            dtypes[field] = str
+        elif re.match(r'^-?[0-9]+$', token):
+            if field in UNSIGNED_FIELDS or schema.get(field) is np.uint64:
+                dtypes[field] = np.uint64
+            else:
+                dtypes[field] = np.int64
+        else:
+            dtypes[field] = np.float64
+    return dtypes
+
+
+def add_time_column(data, field):
+    """
+    Convert stamps in column field to UTC datetime64[ns] and insert them as the
+    'time' column. Stamps are kept in field as float64.
+    """
+    stamps = stamps_to_ns(data[field].values)
+    data[field] = stamps * 1e-9
+    data.insert(0, 'time', pd.to_datetime(stamps, utc=True))
+    return data
+
+
+def parse_lines(text, fields, row=0, schema=None):
+    """
+    Parse complete data lines held in string text, row being the row number of
+    the first one. Same output as DataLoader.read_table().
+    """
+    def reader(dtype):
+        return pd.read_csv(StringIO(text), delimiter=' ', header=None,
+                           names=fields, dtype=dtype)
+
+    if len(text) == 0:
+        data = pd.DataFrame(dict((f, np.zeros(0)) for f in fields),
+                            columns=fields)
+        data[fields[5]] = data[fields[5]].astype(str)
+    else:
+        try:
+            data = reader(sniff_dtypes(text[:text.find('\n')], fields,
+                                       schema))
+        except (ValueError, OverflowError):
+            data = reader({fields[5]: str})
+
+    data.index = pd.RangeIndex(row, row + len(data))
+    data = add_time_column(data, fields[5])
+    if schema is not None:
+        apply_schema(data, schema)
+    return data
+
+
+
 class DataLoader(object):
 
     def __init__(self, datafile):
@@ -58,6 +160,11 @@ class DataLoader(object):
         self.header = list()
         self.headerlen = 0
 
+        # Header and position of the next unread line for follow()
+        self.follow_info = None
+        self.follow_offset = 0
+        self.follow_row = 0
+
         # Store opened file desc if passed by argparse for example, otherwise
         # assumes path and attempt to open it.
         # TODO: should surcharge __del__ to close file descriptor.
@@ -85,6 +192,9 @@ class DataLoader(object):
         for line in self.datafile:
             if line.startswith(comment):
                 self.header.append(line)
+                # Binary records follow, see binfmt
+                if line.startswith(BINARY_MARKER):
+                    break
             else:
                 break
 
@@ -100,6 +210,9 @@ class DataLoader(object):
         magic = ''
         mtype = ''
         version = ''
+        fmt = 'text'
+        dtypes = list()
+        offset = 0
 
         for line in self.header:
             if line.startswith('% description:'):
@@ -124,6 +237,14 @@ class DataLoader(object):
                 version = line.replace('% version: ', '')
                 version = re.sub(r'\n', '', version)
 
+            if line.startswith('% dtypes:'):
+                dtypes = line.replace('% dtypes: ', '')
+                dtypes = re.sub(r'\n', '', dtypes).split(' ')
+
+            if line.startswith(BINARY_MARKER):
+                fmt = 'binary'
+                offset = int(line.replace(BINARY_MARKER, ''))
+
             if line.startswith('%'):
                 self.headerlen += 1
 
@@ -142,18 +263,125 @@ class DataLoader(object):
         header_info['magic'] = magic
         header_info['mtype'] = mtype
         header_info['version'] = int(version)
+        header_info['format'] = fmt
+        if fmt == 'binary':
+            header_info['dtypes'] = dtypes
+            header_info['offset'] = offset
         return header_info
 
 
-    def load_data(self, container):
+    def count_lines(self):
         """
-        Extract tabular stamp data as a pandas.DataFrame.
+        Number of complete (newline terminated) data lines after the header.
+        Reads the file by large blocks, this is much cheaper than parsing it.
+        """
+        self.datafile.seek(0)
+        count = 0
+        while True:
+            block = self.datafile.read(1 << 20)
+            if not block:
+                break
+            count += block.count('\n')
+        return count - self.headerlen
+
+
+    def first_data_line(self):
+        """
+        Return the first line after the header.
         """
+        self.datafile.seek(0)
+        for i, line in enumerate(self.datafile):
+            if i == self.headerlen:
+                return line
+        return ''
 
-        # Extract file header, takes comment character as an option
-        self.extract_header()
-        header_info = self.parse_header()
 
+    def read_table(self, fields, nrows=None, schema=None):
+        """
+        Fast path parser: read data with explicit types instead of relying on
+        pandas inference and a per-row date_parser. The time column is built
+        from field 5 with a single vectorized conversion and keeps nanosecond
+        precision. Same layout as the default parser ('time' column first).
+        Column types are then set by schema if given (see get_schema()).
+        """
+        chunks = list(self.iter_table(fields, nrows=nrows, schema=schema))
+        if len(chunks) == 1:
+            return chunks[0]
+        return pd.concat(chunks)
+
+
+    def iter_table(self, fields, nrows=None, chunksize=None, schema=None):
+        """
+        Generator version of read_table(), yields DataFrames of at most
+        chunksize rows, indexed by row number in the file. Column types are
+        guessed from the first line, if a later row does not fit, types of the
+        remaining chunks are inferred and only ever widened from one chunk to
+        the next (eg. int64 then float64 once a row holds a fraction).
+        """
+        dtypes = sniff_dtypes(self.first_data_line(), fields, schema)
+        done = 0
+
+        def reader(skip, dtype):
+            self.datafile.seek(0)
+            if nrows is not None:
+                rows = nrows - skip
+            else:
+                rows = None
+            return pd.read_csv(self.datafile, delimiter=' ', header=None,
+                               skiprows=self.headerlen + skip, names=fields,
+                               dtype=dtype, nrows=rows, chunksize=chunksize)
+
+        def convert(data):
+            data.index = pd.RangeIndex(done, done + len(data))
+            data = add_time_column(data, fields[5])
+            if schema is not None:
+                apply_schema(data, schema)
+            return data
+
+        try:
+            for data in self.as_chunks(reader(0, dtypes)):
+                data = convert(data)
+                done += len(data)
+                yield data
+        except (ValueError, OverflowError):
+            # Types guessed from first line do not hold for the whole file,
+            # let pandas infer them for the remaining lines (time conversion
+            # is still vectorized), casting to the widest type seen so far
+            for data in self.as_chunks(reader(done, {fields[5]: str})):
+                for field in list(fields[:5]) + list(fields[6:]):
+                    values = data[field].values
+                    current = dtypes.get(field, values.dtype)
+                    if values.dtype.kind not in 'uif' or current is str:
+                        continue
+                    # Counters inferred as int64 stay unsigned if they fit
+                    if (np.dtype(current).kind == 'u' and
+                        values.dtype.kind == 'i' and (values >= 0).all()):
+                        data[field] = values.astype(current)
+                        continue
+                    dtypes[field] = np.promote_types(current, values.dtype)
+                    if data[field].dtype != dtypes[field]:
+                        data[field] = data[field].astype(dtypes[field])
+                data = convert(data)
+                done += len(data)
+                yield data
+
+
+    @staticmethod
+    def as_chunks(reader):
+        """
+        read_csv returns a DataFrame or an iterator of DataFrames depending on
+        chunksize, always iterate.
+        """
+        if isinstance(reader, pd.DataFrame):
+            return [reader]
+        return reader
+
+
+    @staticmethod
+    def fill_header(container, header_info):
+        """
+        Check container type matches the header and copy header info over.
+        """
         if container.mtype != header_info['mtype']:
             print 'Data type mismatch %s %s' % (container.mtype,
                                                 header_info['mtype'])
@@ -161,16 +389,45 @@ class DataLoader(object):
 
         container.description = header_info['description']
         container.fields_from_text = header_info['fields_from_text']
-        container.fields = header_info['fields']
+        container.fields = list(header_info['fields'])
         container.magic = header_info['magic']
         container.version = header_info['version']
 
+
+    def load_data(self, container, fast=False):
+        """
+        Extract tabular stamp data as a pandas.DataFrame.
+        If fast is True, use the fast path parser (see read_table()), which
+        also only drops the last line if it is incomplete.
+        """
+
+        # Extract file header, takes comment character as an option
+        self.extract_header()
+        header_info = self.parse_header()
+        self.fill_header(container, header_info)
+        schema = get_schema(container.mtype, container.version,
+                            container.fields)
+
+        # Binary records are memory mapped, no parsing
+        if header_info['format'] == 'binary':
+            records = open_records(self.datafile.name, header_info)
+            container.data = apply_schema(records_frame(records,
+                            container.fields, schema=schema), schema)
+            return
+
         # Pandas infers the type of data automatically, and maps data to float64
         # or int64. Problem, may arise when integers are way too big (eg NTP
         # key) and uses the full 64 bit range. Pandas convert unsigned to
         # signed, leading to negative and non unique number.  Should be fine on
         # merged data (since keys are dropped), but something to keep in mind if
         # raw timestamps get too big?
+        # The fast path parser reads integers as unsigned to avoid this.
+        if fast:
+            container.data = self.read_table(container.fields,
+                                             nrows=self.count_lines(),
+                                             schema=schema)
+            return
+
         self.datafile.seek(0)
 
         data = pd.read_csv( self.datafile, delimiter= ' ',
@@ -178,16 +435,233 @@ class DataLoader(object):
                             parse_dates={'time' : [5]},
                             keep_date_col=True,
                             date_parser=stamp_parser)
-        container.data = data[:-1]
+        data.drop(data.index[-1:], inplace=True)
+        container.data = apply_schema(data, schema)
+
+
+    def iter_chunks(self, container_cls, rows=1000000):
+        """
+        Iterate over the data file by containers of at most rows lines, so
+        files larger than memory can be processed. Header is parsed once and
+        the container type is taken from it, container_cls being the class of
+        containers to create (eg. DataRadclock). Uses the fast path parser and
+        ignores the last line if incomplete. Column types of a text file may
+        widen from one container to the next (see iter_table()), those of a
+        binary file are fixed.
+        """
+        self.extract_header()
+        header_info = self.parse_header()
+        fields = header_info['fields']
+        schema = get_schema(header_info['mtype'], header_info['version'],
+                            fields)
+
+        if header_info['format'] == 'binary':
+            records = open_records(self.datafile.name, header_info)
+            chunks = (apply_schema(records_frame(records[start:start + rows],
+                                fields, start, schema), schema)
+                      for start in range(0, len(records), rows))
+        else:
+            chunks = self.iter_table(fields, nrows=self.count_lines(),
+                                     chunksize=rows, schema=schema)
+
+        for data in chunks:
+            container = container_cls(header_info['mtype'])
+            self.fill_header(container, header_info)
+            container.data = data
+            yield container
+
+
+    def load_range(self, container, t0, t1):
+        """
+        Load rows with time in [t0, t1) into container. Times are UNIX
+        timestamps or anything pandas.Timestamp understands, and stamps are
+        assumed increasing in the file. Binary files are searched in place and
+        only the matching records are read. For text files, a sidecar index
+        (see StampIndex) is built on first use and only the lines around the
+        range are parsed.
+        """
+        self.extract_header()
+        header_info = self.parse_header()
+        self.fill_header(container, header_info)
+        schema = get_schema(container.mtype, container.version,
+                            container.fields)
+        bounds = [to_ns(t0), to_ns(t1)]
+
+        if header_info['format'] == 'binary':
+            records = open_records(self.datafile.name, header_info)
+            start, stop = np.searchsorted(records[container.fields[5]], bounds)
+            container.data = apply_schema(records_frame(records[start:stop],
+                            container.fields, start, schema), schema)
+            return
+
+        path = getattr(self.datafile, 'name', None)
+        if isinstance(path, basestring) and os.path.isfile(path):
+            index = StampIndex.open(path, len(''.join(self.header)))
+            data = self.read_bytes(container.fields, *index.lookup(*bounds),
+                                   schema=schema)
+        else:
+            # Streams cannot be indexed, load everything
+            self.load_data(container, fast=True)
+            data = container.data
+
+        stamps = data['time'].values.view(np.int64)
+        start, stop = np.searchsorted(stamps, bounds)
+        container.data = data.iloc[start:stop]
+
+
+    def read_bytes(self, fields, start, stop, row=0, schema=None):
+        """
+        Parse the data lines between byte offsets start and stop (both at line
+        boundaries), row being the row number of the first one. Same output as
+        read_table().
+        """
+        self.datafile.seek(start)
+        return parse_lines(self.datafile.read(stop - start), fields, row,
+                           schema)
+
+
+    def follow(self, container, window=None):
+        """
+        Tail mode for files still being written, eg. by radclock. The first
+        call loads the whole file into container. Later calls only parse the
+        complete lines (or records) appended since the previous call, append
+        them to container.data and return them as a DataFrame (empty if there
+        is nothing new). A partial last line is left for the next call. If
+        window is given, only the last window rows are kept in container, so
+        the cost of a refresh does not grow with the file. The file is read
+        again from the start if it got truncated.
+        """
+        fileno = self.datafile.fileno()
+        if self.follow_info is not None and \
+           os.fstat(fileno).st_size < self.follow_offset:
+            print 'Data file truncated, reading it again'
+            self.follow_info = None
+
+        if self.follow_info is None:
+            self.extract_header()
+            header_info = self.parse_header()
+            self.fill_header(container, header_info)
+            container.data = pd.DataFrame()
+            schema = get_schema(header_info['mtype'], header_info['version'],
+                                header_info['fields'])
+            self.follow_info = (header_info, schema)
+            self.follow_row = 0
+            if header_info['format'] == 'binary':
+                self.follow_offset = header_info['offset']
+            else:
+                self.follow_offset = len(''.join(self.header))
+
+        header_info, schema = self.follow_info
+        fields = header_info['fields']
+        if header_info['format'] == 'binary':
+            records = open_records(self.datafile.name, header_info)
+            data = records_frame(records[self.follow_row:], fields,
+                                 self.follow_row, schema)
+            apply_schema(data, schema)
+            self.follow_offset += len(data) * records.dtype.itemsize
+        else:
+            self.datafile.seek(self.follow_offset)
+            text = self.datafile.read()
+            text = text[:text.rfind('\n') + 1]
+            data = parse_lines(text, fields, self.follow_row, schema)
+            self.follow_offset += len(text)
+        self.follow_row += len(data)
+
+        if len(container.data) == 0:
+            container.data = data
+        elif len(data) > 0:
+            container.data = pd.concat([container.data, data])
+        if window is not None and len(container.data) > window:
+            container.data = container.data.iloc[-window:]
+        return data
+
+
+    def write_binary(self, path, rows=1000000):
+        """
+        Convert the data file to a binary stamp file at path (see binfmt),
+        which DataLoader then memory maps instead of parsing. Reads rows lines
+        at a time and ignores the last line if incomplete. Record types are
+        those of the first chunk, if a later chunk needs wider types (see
+        iter_table()) the file is written again with them.
+        """
+        self.extract_header()
+        header_info = self.parse_header()
+        if header_info['format'] == 'binary':
+            print 'Data file is already binary'
+            raise exceptions.TypeError
+        fields = header_info['fields']
+
+        dtypes = None
+        done = False
+        while not done:
+            fdesc = open(path, 'wb')
+            dtype = None
+            done = True
+            for data in self.iter_table(fields, nrows=self.count_lines(),
+                                        chunksize=rows):
+                if len(data) == 0:
+                    continue
+                chunk = data_dtypes(data, fields)
+                if dtypes is None:
+                    dtypes = chunk
+                wider = [np.promote_types(a, b) for a, b in zip(dtypes, chunk)]
+                if wider != dtypes:
+                    dtypes = wider
+                    done = False
+                    break
+                if dtype is None:
+                    write_header(fdesc, header_info, dtypes)
+                    dtype = record_dtype(fields, dtypes)
+                write_records(fdesc, data, fields, dtype)
+            fdesc.close()
+
+        if dtype is None:
+            print 'No data to convert'
+            os.remove(path)
+            raise exceptions.ValueError
 
 
 
     @classmethod
-    def load(cls, datafile, container):
+    def load(cls, datafile, container, fast=False, cache=None):
+        """
+        Load datafile into container. If cache is a DataCache (or True for the
+        default one), parsed data is cached on disk and reused as long as the
+        file does not change. Pass cache=None to bypass the cache.
+        """
 
         # Set data type
         assert(container.mtype in DataContainer.mergeTypes)
 
+        # Only paths to regular files can be cached
+        path = getattr(datafile, 'name', datafile)
+        if cache is True:
+            cache = DataCache()
+        if not isinstance(path, basestring) or not os.path.isfile(path):
+            cache = None
+        # Binary files are memory mapped, faster than the cache
+        elif cache is not None and is_binary(path):
+            cache = None
+
+        # Bump the version when the parsed layout changes
+        variant = 'fast=%s v3' % fast
+        if cache is not None:
+            entry = cache.fetch(path, variant)
+            if entry is not None:
+                cls.fill_header(container, entry[0])
+                container.data = entry[1]
+                return
+
         loader = DataLoader(datafile)
-        loader.load_data(container)
+        loader.load_data(container, fast=fast)
+
+        if cache is not None:
+            header_info = dict()
+            header_info['description'] = container.description
+            header_info['fields'] = container.fields
+            header_info['fields_from_text'] = container.fields_from_text
+            header_info['magic'] = container.magic
+            header_info['mtype'] = container.mtype
+            header_info['version'] = container.version
+            cache.store(path, header_info, container.data, variant)
 
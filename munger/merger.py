@@ -38,29 +38,44 @@ class DataMerger(object):
 
     MERGE_RADCLOCK = 1
     MERGE_UDP = 2
+    MERGE_STREAMS = 3
 
 
     @classmethod
-    def merge(cls, left, right):
+    def merge(cls, left, right, tolerance=None):
         merge_op = 0
+        if DataContainer.mergeTypes.get(left.mtype, '') != '':
+            merge_op = cls.MERGE_STREAMS
+        elif DataContainer.mergeTypes.get(right.mtype, '') != '':
+            # Streams merge into the one with a transition, in any order
+            merge_op = cls.MERGE_STREAMS
+            left, right = right, left
         for container in (left, right):
             assert(isinstance(container, DataContainer))
             if container.mtype == 'radclock':
                 merge_op = cls.MERGE_RADCLOCK
-            elif container.mtype == 'UDP_merged':
+            elif container.mtype in ('UDP_sniff', 'UDP_dag'):
                 merge_op = cls.MERGE_UDP
 
         if merge_op == cls.MERGE_RADCLOCK:
-            return cls.merge_radclock(left, right)
+            return cls.merge_radclock(left, right, tolerance)
         elif merge_op == cls.MERGE_UDP:
-            return cls.merge_udp(left, right)
+            return cls.merge_udp(left, right, tolerance=tolerance)
+        elif merge_op == cls.MERGE_STREAMS:
+            return cls.merge_into_left(left, right, tolerance=tolerance)
         else:
             print 'Cannot figure out what you are trying to merge'
             raise exceptions.TypeError
 
 
     @classmethod
-    def merge_radclock(cls, left, right):
+    def merge_radclock(cls, left, right, tolerance=None):
+        """
+        Join radclock data with the RAD_merged stamps on Tf. Inputs are not
+        modified. Keys are matched with a sorted search instead of a hash
+        join, and tolerance allows matching keys that are not exactly equal
+        (nearest one within tolerance).
+        """
 
         if left.mtype == 'radclock' and right.mtype == 'RAD_merged':
             radclock = left
@@ -72,34 +87,147 @@ class DataMerger(object):
             print 'Cannot container types in merge_radclock'
             raise exceptions.TypeError
 
-        stamps.data['key'] = stamps.data['Tf']
+        sidx, ridx = sorted_join(stamps.data['Tf'].values,
+                                 radclock.data['Tf'].values, tolerance)
 
-        radclock.data['key'] = radclock.data['Tf']
-        fields = radclock.fields
-        # Tb will be a duplicate after merge, remove it now (otherwise pandas
-        # will change its name
-        fields.remove('Tb')
-        fields.append('key')
-        fields.remove('Tf')
-        radclock.data = radclock.data[fields]
+        # Remove first 2 lines, it is often a bit dodgy there
+        sidx = sidx[2:]
+        ridx = ridx[2:]
+
+        # Tb will be a duplicate after merge, remove it now. Tf is the key.
+        stamps_fields = [f for f in stamps.data.columns
+                            if f not in ('time', 'key')]
+        radclock_fields = [f for f in radclock.fields
+                            if f not in ('Tb', 'Tf', 'time', 'key')
+                            and f in radclock.data.columns]
+        data = joined_frame(stamps.data, sidx, stamps_fields,
+                            radclock.data, ridx, radclock_fields)
 
-        # Important: a pandas merge on column DISCARDS indexes. Very annoying.
-        data = pd.merge(stamps.data, radclock.data,
-                                on='key', how='inner', sort=False)
+        merged = DataRadclock()
+        merged.data = data
+        merged.fields = list(data.columns)
+        return merged
 
-        # Reindex using time and clean up extra columns
-        data.index = data.time
 
-        fields = list(data.columns)
-        fields.remove('key')
-        fields.remove('time')
-        data = data[fields] 
+    @classmethod
+    def merge_udp(cls, left, right, on='key', tolerance=None):
+        """
+        Join UDP probes seen by the sniffer with the same packets seen by the
+        DAG card, giving a UDP_merged container. Order of arguments does not
+        matter.
+        """
+        if left.mtype == 'UDP_sniff' and right.mtype == 'UDP_dag':
+            return cls.merge_into_left(left, right, on, tolerance)
+        elif right.mtype == 'UDP_sniff' and left.mtype == 'UDP_dag':
+            return cls.merge_into_left(right, left, on, tolerance)
+        else:
+            print 'Cannot container types in merge_udp'
+            raise exceptions.TypeError
 
-        # Remove first 2 lines, it is often a bit dodgy there
-        data = data.ix[2:]
 
-        merged = DataRadclock()
+    @classmethod
+    def merge_into_left(cls, left, right, on='key', tolerance=None):
+        """
+        Generic join of two streams on field on, following mergeTypes: the
+        result has the type the left type transitions to (eg. NTP_sniff_snd
+        merged with NTP_sniff_rcv gives NTP_rad). Keeps left order and time
+        index, right columns also in left are suffixed as pandas would do.
+        Inputs are not modified.
+        """
+        mtype = DataContainer.mergeTypes.get(left.mtype, '')
+        if mtype == '':
+            print 'No merge defined for type %s' % left.mtype
+            raise exceptions.TypeError
+
+        lidx, ridx = sorted_join(left.data[on].values, right.data[on].values,
+                                 tolerance)
+        left_fields = [f for f in left.data.columns if f != 'time']
+        right_fields = [f for f in right.data.columns
+                            if f not in ('time', on)]
+        data = joined_frame(left.data, lidx, left_fields,
+                            right.data, ridx, right_fields)
+
+        merged = DataContainer(mtype)
         merged.data = data
-        merged.fields = fields
+        merged.fields = list(data.columns)
         return merged
 
+
+
+def joined_frame(ldata, lidx, lfields, rdata, ridx, rfields):
+    """
+    Build the result of a join from matching row indices. Output columns are
+    allocated once, fields present on both sides get suffixed with _x and _y.
+    Index is the left time column (or left index if there is no time column).
+    """
+    both = set(lfields) & set(rfields)
+    columns = list()
+    for f in lfields:
+        if f in both:
+            columns.append((f + '_x', ldata[f], lidx))
+        else:
+            columns.append((f, ldata[f], lidx))
+    for f in rfields:
+        if f in both:
+            columns.append((f + '_y', rdata[f], ridx))
+        else:
+            columns.append((f, rdata[f], ridx))
+
+    if 'time' in ldata.columns:
+        index = pd.Index(ldata['time'])[lidx]
+        index.name = 'time'
+    else:
+        index = ldata.index[lidx]
+
+    # Columns are added one by one (DataFrame from a dict boxes tz aware
+    # stamps)
+    data = pd.DataFrame(index=index)
+    for name, col, idx in columns:
+        data[name] = col.values.take(idx)
+    return data
+
+
+
+def sorted_join(lkeys, rkeys, tolerance=None):
+    """
+    Inner join of two key arrays, rkeys being sorted in increasing order
+    (sorted here otherwise). Returns the indices of matching pairs in left and
+    right, in left order. Each left key matches the first equal right key, or
+    the nearest one within tolerance if given. Cost is O(L log R) and no hash
+    table is built.
+    """
+    lkeys = np.asarray(lkeys)
+    rkeys = np.asarray(rkeys)
+
+    rorder = None
+    if len(rkeys) > 1 and (rkeys[1:] < rkeys[:-1]).any():
+        rorder = np.argsort(rkeys, kind='mergesort')
+        rkeys = rkeys[rorder]
+
+    lidx = np.arange(len(lkeys))
+    if len(rkeys) == 0:
+        return lidx[:0], lidx[:0]
+
+    pos = np.searchsorted(rkeys, lkeys, side='left')
+    after = np.minimum(pos, len(rkeys) - 1)
+    if tolerance is None:
+        match = (pos < len(rkeys)) & (rkeys[after] == lkeys)
+        ridx = after
+    else:
+        # Nearest of the keys around the insertion point. Differences are
+        # taken in the order that keeps them positive (keys may be unsigned).
+        before = np.maximum(pos - 1, 0)
+        has_after = pos < len(rkeys)
+        has_before = pos > 0
+        dist_after = np.where(has_after, rkeys[after] - lkeys, 0)
+        dist_before = np.where(has_before, lkeys - rkeys[before], 0)
+        use_before = has_before & (~has_after | (dist_before <= dist_after))
+        ridx = np.where(use_before, before, after)
+        dist = np.where(use_before, dist_before, dist_after)
+        match = (has_before | has_after) & (dist <= tolerance)
+
+    lidx = lidx[match]
+    ridx = ridx[match]
+    if rorder is not None:
+        ridx = rorder[ridx]
+    return lidx, ridx
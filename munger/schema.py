@@ -0,0 +1,94 @@
+#/usr/bin/env python
+#
+# ------------------------------------------------------------------------------
+# Copyright (c) 2012, Matt Davis  <matt@synclab.org>
+# Copyright (c) 2012, Julien Ridoux <julien@synclab.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ------------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+
+
+# Column types by data type and format version (from the header), as
+# numpy types, 'category' for flags and other columns with few distinct values,
+# or 'drop' for redundant columns. Fields not listed keep the type found when
+# parsing. Counters are unsigned 64 bit, stamps in seconds need float64.
+SCHEMAS = {
+        ('radclock', 1) : {
+            'Ta'        : np.uint64,
+            'Tf'        : np.uint64,
+            'Tb'        : np.float64,
+            'Te'        : np.float64,
+            'phat'      : np.float64,
+            },
+        ('RAD_merged', 1) : {
+            'Ta'        : np.uint64,
+            'Tf'        : np.uint64,
+            'Tb'        : np.float64,
+            'DAG_TX'    : np.float64,
+            'DAG_RX'    : np.float64,
+            'Tout'      : np.float64,
+            },
+        }
+
+
+def get_schema(mtype, version, fields):
+    """
+    Column types for data of type mtype and format version with the given
+    fields. The timestamp (field 5) is dropped by default, it is parsed into
+    the 'time' column.
+    """
+    schema = dict()
+    if len(fields) > 5:
+        schema[fields[5]] = 'drop'
+    schema.update(SCHEMAS.get((mtype, version), dict()))
+    return schema
+
+
+def apply_schema(data, schema):
+    """
+    Convert columns of data in place to the types given by schema, and drop
+    the redundant ones. String columns not in the schema become categories.
+    Integer types are only applied to integer columns, so a schema never
+    truncates values (a float column stays float).
+    """
+    drop = [f for f in data.columns if schema.get(f) == 'drop']
+    if drop:
+        data.drop(drop, axis=1, inplace=True)
+
+    for name in data.columns:
+        col = data[name]
+        dtype = schema.get(name)
+        if dtype is None:
+            if col.dtype == object:
+                data[name] = col.astype('category')
+        elif dtype == 'category':
+            if not hasattr(col, 'cat'):
+                data[name] = col.astype('category')
+        elif col.dtype != dtype:
+            if np.issubdtype(dtype, np.integer) and \
+               not (np.issubdtype(col.dtype, np.integer) or col.dtype == object):
+                continue
+            data[name] = col.astype(dtype)
+    return data
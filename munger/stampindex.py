@@ -0,0 +1,187 @@
+#/usr/bin/env python
+#
+# ------------------------------------------------------------------------------
+# Copyright (c) 2012, Matt Davis  <matt@synclab.org>
+# Copyright (c) 2012, Julien Ridoux <julien@synclab.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ------------------------------------------------------------------------------
+
+import os
+import tempfile
+import numpy as np
+
+
+class StampIndex(object):
+    """
+    Sidecar index of a text stamp file, stored next to it as <path>.idx. Every
+    stride data lines, it keeps the byte offset, row number and stamp (field
+    5, as int64 nanoseconds) of the line, so the rows of a time range can be
+    read without scanning the file:
+
+        index = StampIndex.open(path, header_size)
+        start, stop, row = index.lookup(t0, t1)
+
+    The index is built once with a block scan of the file, and extended when
+    the file grows (eg. radclock still writing), files being assumed append
+    only. It is rebuilt if the file shrinks or is rewritten with the same
+    size. Stamps are assumed increasing in the file.
+    """
+
+    STRIDE = 10000
+    BLOCK = 1 << 24
+
+    def __init__(self, path, header_size, stride=STRIDE):
+        self.path = path
+        self.header_size = header_size
+        self.stride = stride
+        self.offsets = np.zeros(0, dtype=np.int64)
+        self.rows = np.zeros(0, dtype=np.int64)
+        self.stamps = np.zeros(0, dtype=np.int64)
+        self.end = header_size  # offset following the last complete line
+        self.nrows = 0          # number of complete lines indexed
+        self.size = 0
+        self.mtime = 0.0
+
+
+    @classmethod
+    def open(cls, path, header_size, stride=STRIDE):
+        """
+        Index of path, read from the sidecar file when valid and brought up to
+        date with the data file. The sidecar is saved if it changed (and the
+        directory is writable).
+        """
+        index = cls(path, header_size, stride)
+        index.load()
+        st = os.stat(path)
+        if st.st_size < index.size or (st.st_size == index.size and
+                                       st.st_mtime != index.mtime):
+            index = cls(path, header_size, stride)
+        if (st.st_size, st.st_mtime) != (index.size, index.mtime):
+            index.update()
+            index.save()
+        return index
+
+
+    def sidecar(self):
+        return self.path + '.idx'
+
+
+    def load(self):
+        """
+        Read the sidecar file if it exists and matches this index settings.
+        """
+        if not os.path.isfile(self.sidecar()):
+            return
+        try:
+            saved = np.load(self.sidecar())
+            meta = saved['meta']
+            if (meta[0], meta[1]) != (self.stride, self.header_size):
+                return
+            self.end, self.nrows, self.size = [int(v) for v in meta[2:5]]
+            self.mtime = float(saved['mtime'])
+            self.offsets = saved['offsets']
+            self.rows = saved['rows']
+            self.stamps = saved['stamps']
+            saved.close()
+        except (IOError, ValueError, KeyError):
+            # Unreadable sidecar, will be rebuilt
+            return
+
+
+    def save(self):
+        """
+        Write the sidecar file, atomically. Silently skipped if the directory
+        is not writable, the index then only lives in memory.
+        """
+        meta = np.array([self.stride, self.header_size, self.end, self.nrows,
+                         self.size], dtype=np.int64)
+        try:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.sidecar()) or
+                                       '.', prefix='.tmp-idx-')
+            fdesc = os.fdopen(fd, 'wb')
+            np.savez(fdesc, meta=meta, mtime=np.float64(self.mtime),
+                     offsets=self.offsets, rows=self.rows, stamps=self.stamps)
+            fdesc.close()
+            os.chmod(tmp, 0644)
+            os.rename(tmp, self.sidecar())
+        except (IOError, OSError):
+            return
+
+
+    def update(self):
+        """
+        Index complete lines added after self.end, reading the file by large
+        blocks. Line ends are found with numpy, only one line every stride is
+        split to get its stamp.
+        """
+        # loader imports this module
+        from loader import stamps_to_ns
+
+        st = os.stat(self.path)
+        fdesc = open(self.path, 'rb')
+        fdesc.seek(self.end)
+        offsets = [self.offsets]
+        rows = [self.rows]
+        stamps = [self.stamps]
+        while True:
+            block = fdesc.read(self.BLOCK)
+            ends = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10)
+            if len(ends) == 0:
+                break
+            starts = np.concatenate(([0], ends[:-1] + 1))
+            lines = self.nrows + np.arange(len(ends))
+            keep = np.flatnonzero(lines % self.stride == 0)
+            tokens = [block[starts[i]:ends[i]].split()[5] for i in keep]
+            if tokens:
+                offsets.append(self.end + starts[keep])
+                rows.append(lines[keep])
+                stamps.append(stamps_to_ns(tokens))
+
+            self.end += int(ends[-1]) + 1
+            self.nrows += len(ends)
+            fdesc.seek(self.end)
+        fdesc.close()
+
+        self.offsets = np.concatenate(offsets).astype(np.int64)
+        self.rows = np.concatenate(rows).astype(np.int64)
+        self.stamps = np.concatenate(stamps).astype(np.int64)
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+
+
+    def lookup(self, t0, t1):
+        """
+        Byte range [start, stop) of the file and row number of its first line,
+        covering all lines with stamps in [t0, t1) (int64 nanoseconds). The
+        range may include up to stride lines before and after.
+        """
+        if len(self.stamps) == 0:
+            return self.end, self.end, self.nrows
+        first = max(np.searchsorted(self.stamps, t0, side='right') - 1, 0)
+        last = np.searchsorted(self.stamps, t1, side='left')
+        if last < len(self.stamps):
+            stop = self.offsets[last]
+        else:
+            stop = self.end
+        stop = max(stop, self.offsets[first])
+        return int(self.offsets[first]), int(stop), int(self.rows[first])
@@ -29,5 +29,11 @@
 # Make importing a bit cleaner
 from styles import PlotStyles
 from tseries import tseries
+from live import LiveTseries
 from hist import hist
-from allanvar import allanvar
+from allanvar import allanvar, AllanAccumulator
+from sketch import QuantileSketch
+from histcounts import HistCounts
+from resample import WindowAggregator, TimeSummary
+from pyramid import Pyramid
+from render import Renderer
@@ -26,6 +26,7 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 # ------------------------------------------------------------------------------
 
+import exceptions
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
@@ -34,84 +35,344 @@ import math
 
 from common import *
 
-def power_array(elt, base):
+
+# Positions per block of allanvar_batch(), 512KB buffers
+CHUNK = 1 << 16
+
+
+def octave_timescales(count, smoothed=True):
     """
-    Used with vectorize to create an array of base**elt
+    Aggregation levels (powers of 2) at which the Allan variance of a series of
+    count points is computed.
     """
-    return pow(base, elt)
+    if count < 4:
+        return np.array([], dtype=np.int64)
+
+    max_scale = int(math.floor(math.log(count, 2))) - 1  # Why -1?
+    timescales = 2 ** np.arange(1, max_scale, dtype=np.int64)
+
+    # need at least 2 points at largest timescales, and for smoothing, need at
+    # least 3 points to avoid edge effect
+    if smoothed:
+        return timescales[timescales <= count / 3]
+    return timescales[timescales <= count / 2]
 
 
-def compute_allanvar(ts, smoothed=True):
+def log_timescales(count, per_decade=20, smoothed=True):
     """
-    Main routine to compute Allan variance of timeseries ts.
+    Log-spaced aggregation levels, about per_decade of them per decade (fewer
+    at small timescales, where they collide on integers), up to the largest
+    timescale octave_timescales() could reach.
+    """
+    limit = count / 3 if smoothed else count / 2
+    if limit < 1:
+        return np.array([], dtype=np.int64)
+    points = int(math.ceil(math.log10(limit) * per_decade)) + 1
+    timescales = np.logspace(0, math.log10(limit), points)
+    return np.unique(np.floor(timescales).astype(np.int64))
+
+
+def integrate(ts):
     """
-    max_scale = math.floor(math.log(ts.count(), 2)) - 1  # Why -1?
-    vpow = np.vectorize(power_array)
-    timescales = vpow(np.arange(1, max_scale, 1), 2)
-    # need at least 2 points at largest timescales
-    # TODO Isn't this line redundant with the -1 trick?
-    timescales = timescales[timescales <= ts.count()/2]
+    Cumulative sum of the series with a leading 0, so that the average of
+    samples [i, i+m) is (intdata[i+m] - intdata[i]) / m.
+    The mean is removed first, it does not change the variance but keeps the
+    cumulative sum small and preserves precision on long series.
+    """
+    data = np.asarray(ts, dtype=np.float64)
+    data = data[~np.isnan(data)]
+    intdata = np.zeros(len(data) + 1)
+    if len(data) > 0:
+        np.cumsum(data - data.mean(), out=intdata[1:])
+    return intdata
 
-    variances = np.zeros(len(timescales))
-    stdvar    = np.zeros(len(timescales))
 
-    # for smoothing, need at least 3 points to avoid edge effect
+def allanvar_at_scale(intdata, scale, smoothed=True):
+    """
+    Allan variance at aggregation level scale from the integrated series.
+    Non-overlapping variance uses a strided view of intdata (one aggregated
+    point every scale samples). The smoothed (overlapping) variance uses all
+    origins at once, which is the average over the scale different origins of
+    the non-overlapping estimates.
+    """
+    scale = int(scale)
     if smoothed:
-        smoothed_tscales = timescales[timescales <= len(ts)/3]
-        smoothedvar    = np.zeros(len(smoothed_tscales))
-        smoothedstdvar = np.zeros(len(smoothed_tscales))
+        lag = scale
+    else:
+        intdata = intdata[::scale]
+        lag = 1
 
+    # Second difference of the integrated series is scale times the difference
+    # of consecutive averages
+    if len(intdata) <= 2 * lag:
+        return np.nan
+    x = intdata[2*lag:] - 2 * intdata[lag:-lag] + intdata[:-2*lag]
+    return np.dot(x, x) / (2.0 * scale * scale * len(x))
 
-    # Convert to numpy array
-    intdata = ts.cumsum()
-    vpow = np.vectorize(pow)
 
-    if smoothed == False:
-        # Variance for each aggregation level
-        for i in range(len(timescales)):
-            scale = timescales[i]
-            # Select indices in cumsum vector, with indices[0] = 0
-            indices = range(int(scale), int(ts.count()), int(scale))
-            # Aggregated series at scale 'scale', need to have x[0] = 0
-            data = pd.Series([0])
-            data = data.append(intdata.ix[indices] / scale)
-            data = data.diff().ix[1:]
-            if len(x) > 1:
-                variances[i] = (vpow(data.diff().ix[1:], 2) /
-                                (len(data) - 1) / 2).sum()
-        # TODO: values computed are not the same as the Matlab ones, will need
-        # to check what is going on here ... wondering if it is a rounding
-        # issue??
-        # print variances
+def allanvar_batch(intdata, timescales, smoothed=True, chunk=CHUNK):
+    """
+    Allan variance at any number of aggregation levels from the integrated
+    series, same values as allanvar_at_scale() at each of them. Second
+    differences are evaluated by blocks of chunk positions, for all
+    timescales before moving to the next block, in two preallocated buffers.
+    Blocks of intdata stay in cache across timescales, and memory does not
+    grow with the series (allanvar_at_scale() allocates three arrays of its
+    length per timescale). Timescales too large for the series give NaN.
+    """
+    timescales = np.asarray(timescales, dtype=np.int64)
+    if smoothed:
+        series = [intdata] * len(timescales)
+        lags = timescales
+    else:
+        # One aggregated point every timescale samples, strided views
+        series = [intdata[::m] for m in timescales]
+        lags = np.ones(len(timescales), dtype=np.int64)
+    counts = np.array([len(x) for x in series], dtype=np.int64) - 2 * lags
+
+    sums = np.zeros(len(timescales))
+    first = np.empty(chunk)
+    second = np.empty(chunk)
+    end = counts.max() if len(counts) > 0 else 0
+    for start in range(0, end, chunk):
+        for i in np.flatnonzero(counts > start):
+            data = series[i]
+            lag = lags[i]
+            size = min(chunk, counts[i] - start)
+            x = first[:size]
+            y = second[:size]
+            np.add(data[start+2*lag:start+2*lag+size], data[start:start+size],
+                   out=x)
+            np.multiply(data[start+lag:start+lag+size], 2, out=y)
+            x -= y
+            sums[i] += np.dot(x, x)
 
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variances = sums / (2.0 * timescales * timescales * counts)
+    variances[counts <= 0] = np.nan
+    return variances
+
+
+def compute_allanvar(ts, smoothed=True, timescales=None, chunk=CHUNK):
+    """
+    Main routine to compute Allan variance of timeseries ts.
+    Returns the aggregation levels and the Allan variance at each of them.
+    timescales defaults to octave_timescales(), any grid can be given (eg.
+    log_timescales()) and is evaluated in one blocked pass (see
+    allanvar_batch(), chunk bounds memory). Cost is O(N) per timescale and NaN
+    are ignored.
+    """
+    intdata = integrate(ts)
+    if timescales is None:
+        timescales = octave_timescales(len(intdata) - 1, smoothed)
+    timescales = np.asarray(timescales, dtype=np.int64)
+
+    return timescales, allanvar_batch(intdata, timescales, smoothed, chunk)
+
+
+
+def grid_samples(ts, period=None):
+    """
+    Bucket samples of ts on a regular grid of its int64 nanosecond time index,
+    in one vectorized pass: period (seconds) defaults to the median interval,
+    samples go to the nearest grid point and are averaged if several fall in
+    the same one. Returns the grid values (mean removed, 0 where no sample),
+    the validity mask (False for missed polls, restarts or NaN) and the grid
+    period.
+    """
+    stamps = ts.index.asi8
+    values = np.asarray(ts, dtype=np.float64)
+    keep = ~np.isnan(values)
+    stamps = stamps[keep]
+    values = values[keep]
+    if len(values) < 2:
+        return np.zeros(len(values)), np.ones(len(values), dtype=bool), period
+
+    if period is None:
+        step = int(np.median(np.diff(stamps)))
     else:
-        # Smoothed variance for each aggregation level
-        for i in range(len(smoothed_tscales)):
-            scale = timescales[i]
-            # calculate over the T different origins
-            for origin in range(int(scale)):
-                # first result already done, no need to calculate
-                if origin == 0:
-                    indices = range(int(scale), int(ts.count()), int(scale))
-                else:
-                    indices = range(origin-1, int(ts.count()), int(scale))
-
-                    # no longer need data(0)=0, now data(origin-1)
-                    data = pd.Series([0])
-                    data = data.append(intdata.ix[indices] / scale)
-                    data = data.diff().ix[1:]
-                    # calc Allan Var
-                    variances[i] = (vpow(data.diff().ix[1:], 2) /
-                                    (len(x) - 1) / 2).sum()
-                # accumulate at each origin
-                smoothedvar[i] = smoothedvar[i] + variances[i]
-            # take the average
-            smoothedvar[i] = smoothedvar[i] / timescales[i]
-
-    if smoothed == True:
-        variances = smoothedvar
-
-    return timescales, variances
+        step = int(round(period * 1e9))
+    if step <= 0:
+        print 'Cannot build a sampling grid with a null period'
+        raise exceptions.ValueError
+    ids = (stamps - stamps.min() + step // 2) // step
+    size = ids.max() + 1
+    counts = np.bincount(ids, minlength=size)
+    sums = np.bincount(ids, values - values.mean(), minlength=size)
+    valid = counts > 0
+    data = np.zeros(size)
+    data[valid] = sums[valid] / counts[valid]
+    return data, valid, step * 1e-9
+
+
+def compute_gap_allanvar(ts, period=None, timescales=None):
+    """
+    Overlapping Allan, modified Allan and time variances of ts, using its time
+    index instead of assuming evenly spaced samples (see grid_samples()). An
+    Allan term is kept only if the 2m samples of its two averages are all
+    present, a modified Allan term if its 3m-1 samples are, each variance
+    being normalised by its number of terms. Sums of samples and of the
+    validity mask are integrated once and shared by all timescales, so each
+    timescale costs a few passes over slices.
+    Returns a DataFrame indexed by timescale (aggregation levels in grid
+    points, octaves by default) with tau (seconds), avar, mvar, tvar and the
+    number of terms avar_count and mvar_count. Variances without any complete
+    term are NaN.
+    """
+    data, valid, period = grid_samples(ts, period)
+    size = len(data)
+    if timescales is None:
+        timescales = octave_timescales(size)
+    timescales = np.asarray(timescales, dtype=np.int64)
+
+    intdata = np.zeros(size + 1)
+    np.cumsum(data, out=intdata[1:])
+    present = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(valid, out=present[1:])
+
+    avar = np.repeat(np.nan, len(timescales))
+    mvar = np.repeat(np.nan, len(timescales))
+    avar_count = np.zeros(len(timescales), dtype=np.int64)
+    mvar_count = np.zeros(len(timescales), dtype=np.int64)
+    for i, m in enumerate(timescales):
+        if 2 * m > size:
+            continue
+        # m times the difference of consecutive averages
+        x = intdata[2*m:] - 2 * intdata[m:-m] + intdata[:-2*m]
+        ok = present[2*m:] - present[:-2*m] == 2 * m
+        avar_count[i] = np.count_nonzero(ok)
+        if avar_count[i] > 0:
+            avar[i] = np.dot(x[ok], x[ok]) / (2.0 * m * m * avar_count[i])
+
+        if 3 * m - 1 > size:
+            continue
+        # Sums of m consecutive terms, from the integrated terms
+        intx = np.zeros(len(x) + 1)
+        np.cumsum(x, out=intx[1:])
+        y = intx[m:] - intx[:-m]
+        ok = present[3*m-1:] - present[:-(3*m-1)] == 3 * m - 1
+        mvar_count[i] = np.count_nonzero(ok)
+        if mvar_count[i] > 0:
+            mvar[i] = np.dot(y[ok], y[ok]) / (2.0 * m**4 * mvar_count[i])
+
+    tau = timescales * period
+    result = pd.DataFrame(index=pd.Index(timescales, name='timescale'))
+    result['tau'] = tau
+    result['avar'] = avar
+    result['mvar'] = mvar
+    result['tvar'] = tau * tau / 3 * mvar
+    result['avar_count'] = avar_count
+    result['mvar_count'] = mvar_count
+    return result
+
+
+
+class AllanAccumulator(object):
+    """
+    Online non-overlapping Allan variance, for data coming in chunks (eg.
+    monitoring a radclock running for months).
+    Samples are aggregated in a cascade of octave levels. Each level only keeps
+    the sum of a block waiting for its pair, the last block average and the
+    running sum of squared differences, so memory is O(log N) and each chunk
+    costs O(len(chunk)). Results are identical to
+    compute_allanvar(ts, smoothed=False) on the concatenated series.
+    """
+
+    def __init__(self, period=None, name=None):
+        self.period = period
+        self.name = name
+        self.count = 0
+        self._ref = None
+        self._carry = list()     # sum of a block waiting for its pair
+        self._last = list()      # last block average
+        self._sumsq = list()     # sum of squared differences of averages
+        self._ndiff = list()     # number of differences
+
+    def update(self, ts):
+        """
+        Add a chunk of samples. If ts is a pandas Series, its name and time
+        index are used to set the name and period if not known yet.
+        """
+        if isinstance(ts, pd.Series):
+            if self.name is None:
+                self.name = ts.name
+            if self.period is None and len(ts) > 1:
+                timestamps = np.diff(ts.index.asi8) # intervals as nanoseconds.
+                self.period = round(np.median(timestamps) * 1e-9)
+
+        data = np.asarray(ts, dtype=np.float64)
+        data = data[~np.isnan(data)]
+        if len(data) == 0:
+            return
+        self.count += len(data)
+
+        # Remove first value seen, it does not change the variance but keeps
+        # block sums small
+        if self._ref is None:
+            self._ref = data[0]
+        blocks = data - self._ref
+
+        level = 0
+        while len(blocks) > 0:
+            if level == len(self._carry):
+                self._carry.append(None)
+                self._last.append(None)
+                self._sumsq.append(0.0)
+                self._ndiff.append(0)
+
+            # Differences of consecutive block averages at this level
+            avg = blocks / 2.0**level
+            if self._last[level] is not None:
+                diffs = np.diff(np.concatenate(([self._last[level]], avg)))
+            else:
+                diffs = np.diff(avg)
+            self._sumsq[level] += np.dot(diffs, diffs)
+            self._ndiff[level] += len(diffs)
+            self._last[level] = avg[-1]
+
+            # Pair blocks to build the next level, keep odd one for later
+            if self._carry[level] is not None:
+                blocks = np.concatenate(([self._carry[level]], blocks))
+                self._carry[level] = None
+            if len(blocks) % 2 == 1:
+                self._carry[level] = blocks[-1]
+                blocks = blocks[:-1]
+            blocks = blocks[0::2] + blocks[1::2]
+            level += 1
+
+    def compute_allanvar(self):
+        """
+        Current estimate, same (timescales, variances) as compute_allanvar().
+        """
+        timescales = octave_timescales(self.count, smoothed=False)
+        variances = np.zeros(len(timescales))
+        for i in range(len(timescales)):
+            level = int(math.log(timescales[i], 2))
+            if self._ndiff[level] > 0:
+                variances[i] = self._sumsq[level] / self._ndiff[level] / 2
+            else:
+                variances[i] = np.nan
+        return timescales, variances
+
+    def confidence(self, sigmas=1.0):
+        """
+        Confidence interval on the current variances, as (timescales, lower,
+        upper). Uses the chi-squared distribution with one degree of freedom
+        per difference, approximated a la Wilson-Hilferty for sigmas standard
+        deviations.
+        """
+        timescales, variances = self.compute_allanvar()
+        edf = np.array([self._ndiff[int(math.log(t, 2))] for t in timescales],
+                       dtype=np.float64)
+
+        def chi2(z):
+            h = 2 / (9 * edf)
+            return edf * np.maximum(1 - h + z * np.sqrt(h), 0)**3
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lower = edf * variances / chi2(sigmas)
+            upper = edf * variances / chi2(-sigmas)
+        return timescales, lower, upper
 
 
 
@@ -119,28 +380,63 @@ def compute_allanvar(ts, smoothed=True):
 # Plot Allan Variance
 # -----------------------------------------------------------------------------
 def allanvar(ts, ax=None, title='Title', color='b', transparency=0.3,
-        path=None):
+        path=None, timescales=None, gaps=False, kind='allan'):
     """
     Routine to generate Allan variance.
+    timescales are the aggregation levels (in samples) to plot, octaves by
+    default, eg. log_timescales(len(ts)) for a dense curve.
+    If gaps is True, or kind is 'modified' or 'time', samples are placed on
+    the grid of their time index and terms spanning missing samples are
+    dropped (see compute_gap_allanvar()), kind selecting the Allan, modified
+    Allan or time variance. The grid period is the median interval, not
+    rounded to the second, and the time deviation is plotted unscaled.
+    ts can be an AllanAccumulator, in which case the non-overlapping estimate
+    accumulated so far is plotted along with its confidence interval (at
+    octaves only).
     """
 
     # Ttest that ts is a pandas Series object
-    if not isinstance(ts, pd.Series) and not isinstance(ts, pd.DataFrame):
+    if isinstance(ts, AllanAccumulator):
+        timescale, var = ts.compute_allanvar()
+        period = ts.period
+        tau = timescale * period
+        dev = np.sqrt(var / period)
+    elif not isinstance(ts, pd.Series) and not isinstance(ts, pd.DataFrame):
         print "Data passed to histogram is not a pandas Series or DataFrame"
         return
-
-    timescale, var = compute_allanvar(ts)
-
-    timestamps = np.diff(ts.index.asi8) # intervals as nanoseconds.
-    period = round(np.median(timestamps) * 1e-9)
+    elif gaps or kind != 'allan':
+        variances = {'allan': 'avar', 'modified': 'mvar', 'time': 'tvar'}
+        if kind not in variances:
+            print "Unknown kind of Allan variance: %s" % kind
+            raise exceptions.ValueError
+        # Grid on the median interval, a rounded period would merge samples
+        result = compute_gap_allanvar(ts, None, timescales)
+        tau = result['tau'].values
+        var = result[variances[kind]].values
+        if kind == 'time':
+            dev = np.sqrt(var)
+        else:
+            dev = np.sqrt(var / (tau / result.index.values))
+    else:
+        timestamps = np.diff(ts.index.asi8) # intervals as nanoseconds.
+        period = round(np.median(timestamps) * 1e-9)
+        timescale, var = compute_allanvar(ts, timescales=timescales)
+        tau = timescale * period
+        dev = np.sqrt(var / period)
 
     # Get reasonable figure and axis
     # NOTE: saving to a file takes precedence on axis being specified
     if path != None or ax == None:
         fig = plt.figure(figsize=(5, 3.50)) # in inches!
         ax = fig.gca()
+    else:
+        fig = ax.figure
 
-    plt.loglog(timescale * period, np.sqrt(var / period), 'r-', label=ts.name)
+    ax.loglog(tau, dev, 'r-', label=ts.name)
+    if isinstance(ts, AllanAccumulator):
+        timescale, lower, upper = ts.confidence()
+        ax.fill_between(timescale * period, np.sqrt(lower / period),
+                np.sqrt(upper / period), color=color, alpha=transparency)
 
     # Esthetics
     ax.grid(which='both', axis='both')
@@ -154,9 +450,10 @@ def allanvar(ts, ax=None, title='Title', color='b', transparency=0.3,
     # To have ticks and labels display nicely
     fig.tight_layout()
 
-    # Saving on file
+    # Saving on file, the figure is not needed anymore
     if path != None:
         fig.savefig(path)
+        plt.close(fig)
 
     # Return not scaled stats
     return var
@@ -28,53 +28,103 @@
 
 import exceptions
 import pandas as pd
+import numpy as np
+
+from histcounts import HistCounts
+from resample import TimeSummary
+from sketch import QuantileSketch
 
 def error(msg):
     print " ERROR: "+msg
 
 
 # -----------------------------------------------------------------------------
-def custom_stats(data, ptile_range):
+def percentile_label(p):
+    """
+    Index label of a percentile, as pandas describe() does (eg. '25%').
+    """
+    return '%g%%' % p
+
+
+def column_stats(values, percentiles):
+    """
+    Compute count, mean, std, min, percentiles and max of values in a single
+    partition of the data (all percentiles at once), NaN are ignored.
+    Percentiles are linearly interpolated, like pandas quantile().
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]  # also a copy we can partition in place
+    count = len(values)
+    if count == 0:
+        return [0] + [np.nan] * (len(percentiles) + 4)
+
+    pos = np.asarray(percentiles, dtype=np.float64) / 100.0 * (count - 1)
+    lower = np.floor(pos).astype(np.int64)
+    upper = np.ceil(pos).astype(np.int64)
+    values.partition(np.unique(np.concatenate((lower, upper, [0, count-1]))))
+    ptiles = values[lower] + (values[upper] - values[lower]) * (pos - lower)
+
+    mean = values.mean()
+    if count > 1:
+        std = np.sqrt(np.dot(values - mean, values - mean) / (count - 1))
+    else:
+        std = np.nan
+    return [count, mean, std, values[0]] + list(ptiles) + [values[count-1]]
+
+
+# -----------------------------------------------------------------------------
+def custom_stats(data, ptile_range, percentiles=None):
     """
     Compute basic stats on Series or DataFrame
     NOTE: I didn't wanna subclass pandas classes !!
+    Same index as describe() ('count', 'mean', 'std', 'min', '25%', '50%',
+    '75%', 'max') followed by '1%', '99%', 'lower_bound', 'upper_bound' (the
+    ptile_range percentiles) and any extra percentiles passed, those already
+    in the index being skipped. All columns are computed in one pass (see
+    column_stats()).
+    data can also be a QuantileSketch, HistCounts or TimeSummary (stats as a
+    Series), or a dict of them (stats as a DataFrame, one column per key), in
+    which case percentiles are approximate.
     """
-    stats = None
+    labels = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max', '1%',
+              '99%', 'lower_bound', 'upper_bound']
+    ptiles = [25, 50, 75, 1, 99, ptile_range[0], ptile_range[1]]
 
-    def quantile_as_dataframe(df, q, col):
+    if percentiles is None:
+        percentiles = list()
+    for p in percentiles:
+        label = percentile_label(p)
+        if label not in labels:
+            labels.append(label)
+            ptiles.append(p)
+
+    def reorder(col):
         """
-        Little helper to save lines of code: quantile over a DataFrame returns a
-        series with index being df column names, and index '0'. Need to rewrite
-        index and transpose.
+        column_stats() returns percentiles between min and max, move to
+        describe() order followed by the custom ones.
         """
-        tmp = pd.DataFrame(df.quantile(q=q/100.0), index=df.columns)
-        tmp.columns = [col]
-        return tmp.T
-
-    # Series.describe() returns a Series, DataFrame.describe() returns a
-    # DataFrame. In both cases, the index is made of strings descriptive of the
-    # stat (eg. 'mean')
-    # Add a few custom statistics to stats, returned by describe()
+        return col[:7] + [col[-1]] + col[7:-1]
+
     if isinstance(data, pd.Series):
-        stats = data.describe()
-        stats = pd.concat([
-            stats,
-            pd.Series(data.quantile(q=1/100.0), index=['1%']),
-            pd.Series(data.quantile(q=99/100.0), index=['99%']),
-            pd.Series(data.quantile(q=ptile_range[0]/100.0),
-                                    index=['lower_bound']),
-            pd.Series(data.quantile(q=ptile_range[1]/100.0),
-                                    index=['upper_bound']),
-        ])
+        stats = pd.Series(reorder(column_stats(data.values, ptiles)),
+                          index=labels, name=data.name)
+
+    elif isinstance(data, (QuantileSketch, HistCounts, TimeSummary)):
+        stats = pd.Series(reorder(data.stats(ptiles)), index=labels,
+                          name=getattr(data, 'name', None))
+
+    elif isinstance(data, dict):
+        columns = sorted(data.keys())
+        stats = pd.DataFrame(dict((c, reorder(data[c].stats(ptiles)))
+                                  for c in columns),
+                             index=labels, columns=columns)
 
     elif isinstance(data, pd.DataFrame):
-        stats = data.describe()
-        stats = pd.concat([stats, quantile_as_dataframe(data, 1, '1%')])
-        stats = pd.concat([stats, quantile_as_dataframe(data, 99, '99%')])
-        stats = pd.concat([stats, quantile_as_dataframe(data, ptile_range[0],
-            'lower_bound')])
-        stats = pd.concat([stats, quantile_as_dataframe(data, ptile_range[1],
-            'upper_bound')])
+        columns = [c for c in data.columns if data[c].dtype.kind in 'fiu']
+        stats = pd.DataFrame(dict((c, reorder(column_stats(data[c].values,
+                                                           ptiles)))
+                                  for c in columns),
+                             index=labels, columns=columns)
 
     else:
         raise exceptions.TypeError
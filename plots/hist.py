@@ -30,6 +30,8 @@ import pandas as pd
 import matplotlib.pyplot as plt
 
 from common import *
+from histcounts import HistCounts
+from kde import *
 from styles import *
 
 
@@ -38,16 +40,23 @@ from styles import *
 # -----------------------------------------------------------------------------
 def hist(ts, styles=None, ax=None, ptile_range=(0,100), title='Title',
         color='b', transparency=0.3, unit_scale=('s', 0), xlabel='XLabel',
-        with_yticks=True, with_kde=True, path=None):
+        with_yticks=True, with_kde=True, path=None, bins=500, kde='fft',
+        kde_bw='scott'):
     """
     Convenience function that wraps a few common tasks to generate an
-    histogram based on pandas Series object. It uses pandas.hist(), which in
-    turns relies on matplotlib.hist().
+    histogram based on pandas Series object. Values are binned once in their
+    own unit (see HistCounts) and drawn with matplotlib.hist().
+    ts can also be precomputed HistCounts (eg. merged over chunks, files or
+    hosts), in which case bins are the ones of ts.
+    The KDE is computed on the histogram bins with FFTs (kde='fft', see
+    binned_kde()), kde='exact' uses the pandas (scipy) KDE which cost grows
+    with the number of samples. kde_bw is the bandwidth rule ('scott',
+    'silverman' or a value, in the unit of ts).
     styles parameter takes precedence over color and transparency.
     """
 
     # Ttest that ts is a pandas Series object
-    if not isinstance(ts, pd.Series):
+    if not isinstance(ts, pd.Series) and not isinstance(ts, HistCounts):
         print "Data passed to histogram is not a pandas Series object"
         return
 
@@ -70,35 +79,53 @@ def hist(ts, styles=None, ax=None, ptile_range=(0,100), title='Title',
     # Scale stats
     scaledstats = stats * scale
 
+    # Bin values once, in their own unit
+    if isinstance(ts, HistCounts):
+        counts = ts
+    else:
+        counts = HistCounts(stats['lower_bound'], stats['upper_bound'], bins,
+                            name=ts.name)
+        counts.update(ts.values)
+
     # Get reasonable figure and axis
     # NOTE: saving to a file takes precedence on axis being specified
     if path != None or ax == None:
         fig = plt.figure(figsize=(5, 3.50)) # in inches!
         ax = fig.gca()
     else:
-        fig = plt.gcf()
+        fig = ax.figure
 
     if styles != None:
         plot_color = styles.color_for_name(ts.name)
     else:
         plot_color = color
 
-    # Actual histogram
-    # TODO: cap bin size?
-    (ts * scale).hist(ax=ax, bins=500,
+    # Actual histogram, only bin edges are scaled. Drawn as a single polygon
+    # rather than one patch per bin
+    edges = counts.edges * scale
+    ax.hist(edges[:-1], bins=edges, weights=counts.density(scale),
+        histtype='stepfilled',
         alpha=transparency,
         facecolor=plot_color,
         edgecolor=plot_color,
         linewidth=0,
-        normed=True,
-        range=(scaledstats['lower_bound'],scaledstats['upper_bound']),
         label=''
         # label=ts.name
     )
 
     # Gaussian kernel density estimation
-    if with_kde == True:
+    if with_kde == True and kde == 'exact' and isinstance(ts, pd.Series):
         (ts * scale).plot(ax=ax, kind='kde', style='k--', label='')
+    elif with_kde == True:
+        centers = counts.centers()
+        if isinstance(ts, HistCounts):
+            weights = counts.counts
+        else:
+            weights = linear_binning(ts.values, centers)
+        bw = bandwidth(kde_bw, stats['count'], stats['std'],
+                       stats['75%'] - stats['25%'])
+        density = binned_kde(weights, centers, bw, stats['count'])
+        ax.plot(centers * scale, density / scale, 'k--', label='')
 
     # Esthetics
     ax.grid(which='major', axis='both')
@@ -121,9 +148,10 @@ def hist(ts, styles=None, ax=None, ptile_range=(0,100), title='Title',
         fig.tight_layout()
         print 'Warning: disabled histogram tight layout'
 
-    # Saving on file
+    # Saving on file, the figure is not needed anymore
     if path != None:
         fig.savefig(path)
+        plt.close(fig)
 
     # Return not scaled stats
     return stats
@@ -0,0 +1,159 @@
+#/usr/bin/env python
+#
+# ------------------------------------------------------------------------------
+# Copyright (c) 2012, Matt Davis  <matt@synclab.org>
+# Copyright (c) 2012, Julien Ridoux <julien@synclab.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ------------------------------------------------------------------------------
+
+import exceptions
+import numpy as np
+
+
+class HistCounts(object):
+    """
+    Histogram counts over bins of equal width between lower and upper. Values
+    are binned in one vectorized pass, in their own unit (no scaled copy), and
+    counts of the same bins can be merged across chunks, files or hosts:
+
+        counts = HistCounts(0, 1e-3, bins=500, name='rtt')
+        for chunk in DataLoader(path).iter_chunks(DataRadclock):
+            counts.update(chunk.rtt())
+        hist(counts)
+
+    Values outside of the bins are counted in underflow and overflow. Min and
+    max are exact, other stats are derived from the counts.
+    """
+
+    def __init__(self, lower, upper, bins=500, name=None):
+        self.edges = np.linspace(lower, upper, bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+        self.min = np.nan
+        self.max = np.nan
+        self.name = name
+
+
+    def update(self, values):
+        """
+        Add a chunk of values (array or Series), NaN are ignored.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.min = np.nanmin([self.min, values.min()])
+        self.max = np.nanmax([self.max, values.max()])
+
+        lower = self.edges[0]
+        width = self.edges[1] - self.edges[0]
+        bins = len(self.counts)
+        idx = np.floor((values - lower) / width).astype(np.int64)
+        # Last bin includes upper edge, as numpy.histogram does
+        idx[values == self.edges[-1]] = bins - 1
+
+        inside = (idx >= 0) & (idx < bins)
+        self.underflow += np.count_nonzero(idx < 0)
+        self.overflow += np.count_nonzero(idx >= bins)
+        self.counts += np.bincount(idx[inside], minlength=bins)
+
+
+    def merge(self, other):
+        """
+        Add counts of other, which must have the same bins.
+        """
+        if not np.array_equal(self.edges, other.edges):
+            print 'Cannot merge histograms with different bins'
+            raise exceptions.ValueError
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        self.min = np.nanmin([self.min, other.min])
+        self.max = np.nanmax([self.max, other.max])
+
+
+    def total(self):
+        return self.counts.sum() + self.underflow + self.overflow
+
+
+    def centers(self):
+        return (self.edges[:-1] + self.edges[1:]) / 2
+
+
+    def density(self, scale=1):
+        """
+        Normalised counts of values within bins, with bins scaled by scale.
+        """
+        width = (self.edges[1] - self.edges[0]) * scale
+        inside = self.counts.sum()
+        if inside == 0:
+            return np.zeros(len(self.counts))
+        return self.counts / float(inside) / width
+
+
+    def quantile(self, q):
+        """
+        Approximate quantile(s) q, with q in [0, 1], interpolated within bins.
+        Values in underflow (overflow) are assumed at the lower (upper) edge.
+        """
+        q = np.asarray(q, dtype=np.float64)
+        total = self.total()
+        if total == 0:
+            return q * np.nan
+
+        target = q * total
+        cum = self.underflow + np.cumsum(self.counts)
+        pos = np.minimum(np.searchsorted(cum, target, side='left'),
+                         len(self.counts) - 1)
+        counts = np.maximum(self.counts[pos], 1)
+        within = np.clip((target - (cum[pos] - self.counts[pos])) / counts,
+                         0, 1)
+        width = self.edges[1] - self.edges[0]
+        result = self.edges[pos] + within * width
+        result = np.clip(result, self.min, self.max)
+        result = np.where(q <= 0, self.min, result)
+        return np.where(q >= 1, self.max, result)
+
+
+    def stats(self, percentiles):
+        """
+        Same output as common.column_stats(): count, mean, std, min,
+        percentiles and max. Mean and std use bin centers (values out of bins
+        at the edges).
+        """
+        total = self.total()
+        if total == 0:
+            return [0] + [np.nan] * (len(percentiles) + 4)
+
+        values = np.concatenate(([self.edges[0]], self.centers(),
+                                 [self.edges[-1]]))
+        weights = np.concatenate(([self.underflow], self.counts,
+                                  [self.overflow])).astype(np.float64)
+        mean = np.dot(values, weights) / total
+        if total > 1:
+            std = np.sqrt(np.dot((values - mean)**2, weights) / (total - 1))
+        else:
+            std = np.nan
+        ptiles = self.quantile(np.asarray(percentiles) / 100.0)
+        return [total, mean, std, self.min] + list(ptiles) + [self.max]
@@ -0,0 +1,92 @@
+#/usr/bin/env python
+#
+# ------------------------------------------------------------------------------
+# Copyright (c) 2012, Matt Davis  <matt@synclab.org>
+# Copyright (c) 2012, Julien Ridoux <julien@synclab.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ------------------------------------------------------------------------------
+
+import exceptions
+import math
+import numpy as np
+
+
+def bandwidth(rule, count, std, iqr):
+    """
+    Gaussian kernel bandwidth. rule is 'scott' (what scipy, hence pandas, uses
+    by default), 'silverman' (rule of thumb, robust to outliers), or a number
+    used as is.
+    """
+    if rule == 'scott':
+        return std * count**(-1 / 5.0)
+    elif rule == 'silverman':
+        spread = std
+        if iqr > 0:
+            spread = min(std, iqr / 1.34)
+        return 0.9 * spread * count**(-1 / 5.0)
+    elif isinstance(rule, (int, float)):
+        return float(rule)
+    else:
+        print 'Unknown bandwidth rule %s' % rule
+        raise exceptions.ValueError
+
+
+def linear_binning(values, centers):
+    """
+    Spread each value over the two nearest grid points, proportionally to
+    distance (more accurate than counting in bins for a KDE). Grid points are
+    evenly spaced, values outside of the grid are dropped.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    step = centers[1] - centers[0]
+    pos = (values - centers[0]) / step
+    pos = pos[(pos >= 0) & (pos <= len(centers) - 1)]
+
+    left = np.floor(pos).astype(np.int64)
+    frac = pos - left
+    right = np.minimum(left + 1, len(centers) - 1)
+    weights = np.bincount(left, weights=1 - frac, minlength=len(centers))
+    weights += np.bincount(right, weights=frac, minlength=len(centers))
+    return weights
+
+
+def binned_kde(weights, centers, bw, count):
+    """
+    Gaussian KDE evaluated on the evenly spaced grid centers, from the weights
+    of the data binned on that grid: a convolution of the weights with the
+    kernel done with FFTs. Cost is O(G log G) for G grid points, whatever the
+    number of samples. count is the total number of samples (including those
+    off the grid), for normalisation.
+    """
+    size = len(centers)
+    step = centers[1] - centers[0]
+    # Kernel support truncated at 4 bandwidths
+    half = int(min(size - 1, math.ceil(4 * bw / step)))
+    offsets = np.arange(-half, half + 1) * step
+    kernel = np.exp(-0.5 * (offsets / bw)**2) / (math.sqrt(2 * math.pi) * bw)
+
+    nfft = 2**int(math.ceil(math.log(size + 2 * half, 2)))
+    density = np.fft.irfft(np.fft.rfft(weights, nfft) *
+                           np.fft.rfft(kernel, nfft), nfft)
+    return density[half:half + size] / count
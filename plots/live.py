@@ -0,0 +1,267 @@
+#/usr/bin/env python
+#
+# ------------------------------------------------------------------------------
+# Copyright (c) 2012, Matt Davis  <matt@synclab.org>
+# Copyright (c) 2012, Julien Ridoux <julien@synclab.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ------------------------------------------------------------------------------
+
+import exceptions
+import pandas as pd
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
+
+from common import *
+from sketch import QuantileSketch
+from tseries import MAXSIZE, group_envelope
+
+
+class LiveTseries(object):
+    """
+    Time series figure updated in place, for monitoring data as it comes (eg.
+    from DataLoader.follow()):
+
+        live = LiveTseries(title='rtt', ylabel='RTT')
+        while True:
+            live.append(loader.follow(container).RTT)
+            plt.pause(5)
+
+    The figure owns its axes and one line per column. Appended rows are
+    down-sampled incrementally: complete buckets of width rows are reduced to
+    their M4 envelope (see envelope_sample()), and when there are too many
+    buckets their width doubles and pairs of buckets are merged, so the
+    plotted points stay under maxsize per column whatever the amount of data.
+    Y bounds come from a QuantileSketch per column. The y scale only changes
+    when the spread changes unit (see scale_data()), and limits only when the
+    data gets out of them. Otherwise lines are redrawn alone with blitting
+    when the canvas supports it.
+    """
+
+    def __init__(self, styles=None, ax=None, title='Title', transparency=0.3,
+                 xlabel='Xlabel', ylabel='Ylabel', ptile_range=(1,99),
+                 maxsize=MAXSIZE, blit=True):
+        if ax == None:
+            fig = plt.figure(figsize=(8.0, 3.0)) # in inches!
+            ax = fig.gca()
+        self.fig = ax.figure
+        self.ax = ax
+        self.styles = styles
+        self.transparency = transparency
+        self.ylabel = ylabel
+        self.ptile_range = ptile_range
+        self.blit = blit and self.fig.canvas.supports_blit
+
+        # Incremental M4 state
+        self.buckets = max(maxsize / 8, 1)  # up to 2 * buckets of 4 points
+        self.width = 1                      # rows per bucket
+        self.nbuckets = 0                   # complete buckets
+        self.kept = None                    # envelope rows of those buckets
+        self.groups = np.zeros(0, dtype=np.int64)
+        self.tail = None                    # rows of the incomplete bucket
+
+        self.sketches = dict()
+        self.lines = dict()
+        self.scale = None
+        self.unit = None
+        self.xlim = None
+        self.ylim = None
+        self.background = None
+
+        ax.grid(which='major', axis='both')
+        ax.set_title(title)
+        ax.set_xlabel(xlabel)
+        if self.blit:
+            self.fig.canvas.mpl_connect('draw_event', self.on_draw)
+
+
+    def append(self, data):
+        """
+        Add rows of a pandas.Series or pandas.DataFrame (same columns at each
+        call, increasing index) and update the figure.
+        """
+        if isinstance(data, pd.Series):
+            data = data.to_frame()
+        if not isinstance(data, pd.DataFrame):
+            print "Data passed to LiveTseries is not a pandas object"
+            raise exceptions.TypeError
+        if self.styles != None and self.styles.valid_for_data(data) == False:
+            raise exceptions.KeyError
+        if len(data) == 0:
+            return
+
+        for name in data.columns:
+            if data[name].dtype.kind in 'fiu':
+                if name not in self.sketches:
+                    self.sketches[name] = QuantileSketch()
+                self.sketches[name].update(data[name].values)
+
+        self.add_rows(data)
+        plot_data = self.plot_data()
+        redraw = self.update_limits(plot_data)
+        x = self.xvalues(plot_data.index)
+        for name in self.sketches:
+            if name not in self.lines:
+                self.add_line(name)
+                redraw = True
+            self.lines[name].set_data(x, plot_data[name].values * self.scale)
+
+        if redraw:
+            self.fig.tight_layout()
+        if redraw or not self.blit:
+            self.fig.canvas.draw_idle()
+        else:
+            self.update_lines()
+
+
+    def add_rows(self, data):
+        """
+        Reduce the complete buckets of data (following the tail) to their
+        envelope, and merge buckets by pairs if there are too many.
+        """
+        if self.tail is not None and len(self.tail) > 0:
+            data = pd.concat([self.tail, data])
+        full = len(data) // self.width * self.width
+        if full > 0:
+            groups = np.arange(full) // self.width
+            keep = group_envelope(data.iloc[:full], groups)
+            if self.kept is None:
+                self.kept = data.iloc[keep]
+            else:
+                self.kept = pd.concat([self.kept, data.iloc[keep]])
+            self.groups = np.concatenate((self.groups,
+                                          self.nbuckets + groups[keep]))
+            self.nbuckets += full // self.width
+        self.tail = data.iloc[full:]
+
+        # An odd last bucket is merged alone, so it holds fewer rows than the
+        # next ones (the envelope is the same)
+        while self.nbuckets > 2 * self.buckets:
+            self.width *= 2
+            self.nbuckets = (self.nbuckets + 1) // 2
+            self.groups = self.groups // 2
+            keep = group_envelope(self.kept, self.groups)
+            self.kept = self.kept.iloc[keep]
+            self.groups = self.groups[keep]
+
+
+    def plot_data(self):
+        """
+        Envelope of the complete buckets followed by the envelope of the tail.
+        """
+        tail = self.tail.iloc[group_envelope(self.tail,
+                                             np.zeros(len(self.tail)))]
+        if self.kept is None:
+            return tail
+        return pd.concat([self.kept, tail])
+
+
+    def xvalues(self, index):
+        if isinstance(index, pd.DatetimeIndex):
+            return mdates.date2num(index.values)
+        return np.asarray(index, dtype=np.float64)
+
+
+    def update_limits(self, plot_data):
+        """
+        Update scale and axes limits if needed, returns True if the axes
+        changed (and the background must be redrawn).
+        """
+        stats = custom_stats(self.sketches, self.ptile_range)
+        ymin = stats.loc['lower_bound'].min()
+        ymax = stats.loc['upper_bound'].max()
+        redraw = False
+
+        scale, unit = scale_data(ymax - ymin)
+        if unit != self.unit:
+            self.scale = scale
+            self.unit = unit
+            self.ax.set_ylabel(self.ylabel + ' ' + unit)
+            self.ylim = None
+            redraw = True
+
+        if self.ylim is None or ymin < self.ylim[0] or ymax > self.ylim[1]:
+            self.ylim = (ymin, ymax)
+            self.ax.set_ylim(ymin * self.scale, ymax * self.scale)
+            redraw = True
+
+        # Leave room on the right so appending does not change the axis
+        x = self.xvalues(plot_data.index[[0, -1]])
+        if self.xlim is None or x[0] < self.xlim[0] or x[1] > self.xlim[1]:
+            span = max(x[1] - x[0], 1e-9)
+            self.xlim = (x[0], x[1] + span / 4)
+            self.ax.set_xlim(*self.xlim)
+            if isinstance(plot_data.index, pd.DatetimeIndex):
+                self.ax.xaxis_date()
+                self.fig.autofmt_xdate()
+            redraw = True
+
+        return redraw
+
+
+    def add_line(self, name):
+        kwargs = dict(alpha=self.transparency, animated=self.blit, label=name)
+        if self.styles != None:
+            line, = self.ax.plot([], [], self.styles.linestyle_for_name(name),
+                                 **kwargs)
+        else:
+            line, = self.ax.plot([], [], **kwargs)
+        self.lines[name] = line
+        if len(self.sketches) > 1:
+            self.ax.legend(loc='best')
+
+
+    def on_draw(self, event):
+        """
+        Keep the background (everything but the lines) after a full draw.
+        """
+        canvas = self.fig.canvas
+        self.background = canvas.copy_from_bbox(self.fig.bbox)
+        for line in self.lines.values():
+            self.ax.draw_artist(line)
+
+
+    def update_lines(self):
+        """
+        Blit the lines over the saved background.
+        """
+        canvas = self.fig.canvas
+        if self.background is None:
+            canvas.draw()
+            return
+        canvas.restore_region(self.background)
+        for line in self.lines.values():
+            self.ax.draw_artist(line)
+        canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+
+
+    def save(self, path):
+        """
+        Save the current figure (lines included) to path.
+        """
+        for line in self.lines.values():
+            line.set_animated(False)
+        self.fig.savefig(path)
+        for line in self.lines.values():
+            line.set_animated(self.blit)
@@ -0,0 +1,207 @@
+#/usr/bin/env python
+#
+# ------------------------------------------------------------------------------
+# Copyright (c) 2012, Matt Davis  <matt@synclab.org>
+# Copyright (c) 2012, Julien Ridoux <julien@synclab.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ------------------------------------------------------------------------------
+
+import exceptions
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from resample import WindowAggregator, TimeSummary, build_levels, window_width
+
+
+class QuantileTable(object):
+    """
+    Quantiles of a column at fixed ranks, interpolated in between.
+    """
+
+    def __init__(self, values):
+        self.values = values
+
+
+    def quantile(self, q):
+        ranks = np.linspace(0, 1, len(self.values))
+        return np.interp(q, ranks, self.values)
+
+
+
+class Pyramid(object):
+    """
+    Level of detail pyramid of a stamp file, stored next to it in <path>.lod.
+    For each column (data field or container metric), level 0 holds count,
+    mean, m2, min and max of windows of width, level k of windows 2**k wider,
+    up to a single window. Levels are memory mapped, and tseries draws the
+    level matching the time range and axes width, so plotting any part of a
+    long history reads a few thousands windows only:
+
+        lod = Pyramid.open('radclock.dat', DataRadclock, ['rtt', 'phat'])
+        tseries(lod.summary('rtt'), trange=('2012-10-01', '2012-10-02'))
+
+    The pyramid is built in one pass over chunks of the file, and rebuilt if
+    the file, columns or width change. Quantiles of each column are kept for
+    the stats (0.1% steps).
+    """
+
+    WIDTH = '16s'
+    RANKS = 1001
+    FIELDS = ('start', 'count', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self, path, columns, width=WIDTH):
+        self.path = path
+        self.columns = list(columns)
+        self.width = window_width(width)
+        self.levels = dict()     # column -> list of levels
+        self.quantiles = dict()  # column -> QuantileTable
+        self.size = 0
+        self.mtime = 0.0
+
+
+    @classmethod
+    def open(cls, path, container_cls, columns, width=WIDTH, rows=1000000):
+        """
+        Pyramid of path, memory mapped from the sidecar directory when it
+        matches the data file, or built from chunks of rows lines of
+        container_cls containers (eg. DataRadclock) and saved.
+        """
+        lod = cls(path, columns, width)
+        if not lod.load():
+            lod.build(container_cls, rows)
+            lod.save()
+        return lod
+
+
+    def directory(self):
+        return self.path + '.lod'
+
+
+    def build(self, container_cls, rows=1000000):
+        """
+        Aggregate the columns over DataLoader.iter_chunks() and build levels.
+        """
+        # munger is only needed to build
+        from munger import DataLoader
+
+        st = os.stat(self.path)
+        aggs = dict((name, WindowAggregator(self.width, name))
+                    for name in self.columns)
+        for chunk in DataLoader(self.path).iter_chunks(container_cls, rows):
+            for name in self.columns:
+                if name in chunk.metricsRegistry:
+                    values = chunk.metric(name)
+                else:
+                    values = chunk.data[name]
+                aggs[name].update(values, chunk.data['time'])
+
+        for name in self.columns:
+            windows = aggs[name].windows()
+            del windows['median']
+            self.levels[name] = build_levels(windows, self.width)
+            self.quantiles[name] = QuantileTable(aggs[name].sketch.quantile(
+                                        np.linspace(0, 1, self.RANKS)))
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+
+
+    def load(self):
+        """
+        Memory map the saved pyramid, returns False if there is none or it
+        does not match the data file and settings.
+        """
+        directory = self.directory()
+        try:
+            fdesc = open(os.path.join(directory, 'meta.json'), 'r')
+            meta = json.load(fdesc)
+            fdesc.close()
+        except (IOError, ValueError):
+            return False
+        st = os.stat(self.path)
+        if (meta['size'], meta['mtime'], meta['width'], meta['columns']) != \
+           (st.st_size, st.st_mtime, self.width, self.columns):
+            return False
+
+        for i, name in enumerate(self.columns):
+            # Contiguous arrays, searching a level reads a few pages only
+            arrays = dict((f, np.load(os.path.join(directory,
+                                                   '%d_%s.npy' % (i, f)),
+                                      mmap_mode='r'))
+                          for f in self.FIELDS)
+            bounds = meta['levels'][i]
+            self.levels[name] = [dict((f, arrays[f][a:b]) for f in arrays)
+                                 for a, b in zip(bounds[:-1], bounds[1:])]
+            self.quantiles[name] = QuantileTable(np.load(
+                    os.path.join(directory, '%d_quantiles.npy' % i)))
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        return True
+
+
+    def save(self):
+        """
+        Write the pyramid next to the data file, one array per column and
+        field (levels one after the other). The directory is replaced
+        atomically, saving is silently skipped if it is not writable.
+        """
+        levels = list()
+        tmp = None
+        try:
+            tmp = tempfile.mkdtemp(dir=os.path.dirname(self.directory()) or
+                                   '.', prefix='.tmp-lod-')
+            for i, name in enumerate(self.columns):
+                sizes = [len(level['start']) for level in self.levels[name]]
+                for f in self.FIELDS:
+                    np.save(os.path.join(tmp, '%d_%s.npy' % (i, f)),
+                            np.concatenate([level[f]
+                                            for level in self.levels[name]]))
+                np.save(os.path.join(tmp, '%d_quantiles.npy' % i),
+                        self.quantiles[name].values)
+                levels.append([0] + list(np.cumsum(sizes)))
+
+            fdesc = open(os.path.join(tmp, 'meta.json'), 'w')
+            json.dump({'size': self.size, 'mtime': self.mtime,
+                       'width': self.width, 'columns': self.columns,
+                       'levels': [[int(b) for b in l] for l in levels]}, fdesc)
+            fdesc.close()
+            os.chmod(tmp, 0755)
+            if os.path.isdir(self.directory()):
+                shutil.rmtree(self.directory())
+            os.rename(tmp, self.directory())
+        except (IOError, OSError):
+            if tmp is not None:
+                shutil.rmtree(tmp, ignore_errors=True)
+
+
+    def summary(self, name):
+        """
+        TimeSummary of column name, for tseries().
+        """
+        if name not in self.levels:
+            print 'No column %s in pyramid of %s' % (name, self.path)
+            raise exceptions.KeyError
+        return TimeSummary(self.levels[name], self.width, name,
+                           self.quantiles[name])
@@ -0,0 +1,179 @@
+#/usr/bin/env python
+#
+# ------------------------------------------------------------------------------
+# Copyright (c) 2012, Matt Davis  <matt@synclab.org>
+# Copyright (c) 2012, Julien Ridoux <julien@synclab.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ------------------------------------------------------------------------------
+
+import cPickle as pickle
+import multiprocessing
+import time
+import matplotlib
+import matplotlib.pyplot as plt
+import pandas as pd
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from allanvar import allanvar
+from hist import hist
+from tseries import tseries
+
+
+# Figure size (inches) of each plot function
+FIGSIZES = {
+        tseries     : (8.0, 3.0),
+        hist        : (5, 3.50),
+        allanvar    : (5, 3.50),
+        }
+
+
+def use_agg():
+    """
+    Switch matplotlib to the Agg backend (no display needed).
+    """
+    if matplotlib.get_backend().lower() != 'agg':
+        plt.switch_backend('Agg')
+
+
+def save_figure(data, path):
+    """
+    Worker side of Renderer: unpickle a figure, save it to path and return
+    the time spent.
+    """
+    start = time.time()
+    fig = pickle.loads(data)
+    FigureCanvasAgg(fig)
+    fig.savefig(path)
+    return time.time() - start
+
+
+
+class Renderer(object):
+    """
+    Headless rendering of many plots to files, eg. for nightly reports:
+
+        renderer = Renderer(workers=4)
+        renderer.render('rtt.png', tseries, rtt, title='rtt')
+        renderer.render('rtt_hist.png', hist, rtt, title='rtt')
+        timings = renderer.close()
+
+    Figures are not managed by pyplot (so never leak), one figure per size is
+    kept and cleared for the next plot instead of building a new one. Plot
+    functions draw on the figure axes, then the figure is pickled and saved by
+    a pool of worker processes while the next plot is drawn (workers defaults
+    to one less than the number of cores, 0 saves in the calling process).
+    close() waits for all files and returns the time spent drawing and saving
+    each plot.
+    Plot functions are called without a path, so tseries down-samples the
+    data as on screen (see pixel_sample()), pass sampling=0 to draw all
+    points.
+    """
+
+    def __init__(self, workers=None):
+        use_agg()
+        # By default, draw here and save on the other cores
+        if workers is None:
+            workers = multiprocessing.cpu_count() - 1
+        self.pool = None
+        if workers > 0:
+            self.pool = multiprocessing.Pool(processes=workers)
+        self.figures = dict()
+        self.pending = list()
+        self.timings = dict()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def figure(self, figsize):
+        """
+        Cleared figure of size figsize, created on first use.
+        """
+        if figsize not in self.figures:
+            fig = Figure(figsize=figsize)
+            FigureCanvasAgg(fig)
+            self.figures[figsize] = fig
+        fig = self.figures[figsize]
+        fig.clf()
+        return fig
+
+
+    def render(self, path, func, *args, **kwargs):
+        """
+        Plot with func (eg. tseries, hist) on a recycled figure and save it to
+        path. Other arguments are passed to func, figsize defaults to the size
+        func uses. Returns what func returns.
+        """
+        figsize = kwargs.pop('figsize', FIGSIZES.get(func, (8.0, 3.0)))
+        start = time.time()
+        fig = self.figure(figsize)
+        kwargs['ax'] = fig.add_subplot(111)
+        kwargs['path'] = None
+        result = func(*args, **kwargs)
+        self.timings[path] = [time.time() - start, 0.0]
+
+        data = None
+        if self.pool is not None:
+            try:
+                data = pickle.dumps(fig, pickle.HIGHEST_PROTOCOL)
+            except (pickle.PicklingError, TypeError):
+                # Some artists cannot be pickled, save here
+                data = None
+        if data is None:
+            start = time.time()
+            fig.savefig(path)
+            self.timings[path][1] = time.time() - start
+        else:
+            self.pending.append((path, self.pool.apply_async(save_figure,
+                                                             (data, path))))
+        return result
+
+
+    def wait(self):
+        """
+        Wait until all pending plots are saved.
+        """
+        for path, job in self.pending:
+            self.timings[path][1] = job.get()
+        self.pending = list()
+
+
+    def close(self):
+        """
+        Wait for pending plots, release workers and figures. Returns a
+        DataFrame of plot and save times (seconds) indexed by path.
+        """
+        self.wait()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.figures = dict()
+        return pd.DataFrame(self.timings, index=['plot', 'save']).T
@@ -0,0 +1,404 @@
+#/usr/bin/env python
+#
+# ------------------------------------------------------------------------------
+# Copyright (c) 2012, Matt Davis  <matt@synclab.org>
+# Copyright (c) 2012, Julien Ridoux <julien@synclab.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ------------------------------------------------------------------------------
+
+import exceptions
+import math
+import numpy as np
+import pandas as pd
+
+from pandas.tseries.frequencies import to_offset
+
+from sketch import QuantileSketch
+
+
+# Per window aggregates, m2 is the sum of squared deviations from the mean
+FIELDS = ('start', 'count', 'mean', 'm2', 'min', 'max', 'median')
+
+# Windows with more values have their median computed alone
+LARGE_WINDOW = 256
+
+
+def window_width(window):
+    """
+    Window length in nanoseconds, window being a pandas offset alias (eg.
+    '5Min') or a number of nanoseconds.
+    """
+    if isinstance(window, basestring):
+        return int(to_offset(window).nanos)
+    return int(window)
+
+
+def window_medians(values, starts, count):
+    """
+    Median of each window of values, windows being contiguous slices (see
+    aggregate_windows()). Windows of LARGE_WINDOW values or more are
+    partitioned one by one, smaller ones all at once with the windows of the
+    same size, as rows of a table: no sort of the whole array.
+    """
+    median = np.empty(len(starts))
+    for i in np.flatnonzero(count >= LARGE_WINDOW):
+        low, high = (count[i] - 1) // 2, count[i] // 2
+        window = np.partition(values[starts[i]:starts[i] + count[i]],
+                              [low, high])
+        median[i] = (window[low] + window[high]) / 2
+
+    small = np.flatnonzero(count < LARGE_WINDOW)
+    small = small[np.argsort(count[small], kind='mergesort')]
+    bounds = np.flatnonzero(np.diff(count[small])) + 1
+    for rows in np.split(small, bounds):
+        if len(rows) == 0:
+            continue
+        size = count[rows[0]]
+        low, high = (size - 1) // 2, size // 2
+        table = values[starts[rows][:, np.newaxis] + np.arange(size)]
+        table.partition([low, high], axis=1)
+        median[rows] = (table[:, low] + table[:, high]) / 2
+    return median
+
+
+def aggregate_windows(stamps, values, width, fields=FIELDS):
+    """
+    Aggregate values by windows of width nanoseconds in a single vectorized
+    pass. stamps are int64 nanoseconds in increasing order, windows are
+    aligned on multiples of width since the epoch and NaN values are ignored.
+    Returns a dict of arrays (see FIELDS, start and count always being
+    computed), one item per non-empty window.
+    """
+    stamps = np.asarray(stamps, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    if not valid.all():
+        stamps = stamps[valid]
+        values = values[valid]
+    if len(values) == 0:
+        windows = dict((f, np.zeros(0)) for f in FIELDS if f in fields)
+        windows['start'] = np.zeros(0, dtype=np.int64)
+        windows['count'] = np.zeros(0, dtype=np.int64)
+        return windows
+
+    ids = stamps // width
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(ids)) + 1))
+    count = np.diff(np.concatenate((starts, [len(values)])))
+    windows = {'start': ids[starts] * width, 'count': count}
+
+    if 'mean' in fields or 'm2' in fields:
+        windows['mean'] = np.add.reduceat(values, starts) / count
+    if 'm2' in fields:
+        deviations = values - np.repeat(windows['mean'], count)
+        windows['m2'] = np.add.reduceat(deviations * deviations, starts)
+    if 'min' in fields:
+        windows['min'] = np.minimum.reduceat(values, starts)
+    if 'max' in fields:
+        windows['max'] = np.maximum.reduceat(values, starts)
+    if 'median' in fields:
+        # Up to two values, the median is the mean
+        if count.max() <= 2:
+            windows['median'] = np.add.reduceat(values, starts) / count
+        else:
+            windows['median'] = window_medians(values, starts, count)
+    return windows
+
+
+def merge_windows(windows, width):
+    """
+    Merge aggregates of windows into windows of width nanoseconds (a multiple
+    of their own width). Count, mean, m2, min and max are exact, the median
+    (if any) is approximated by the count weighted mean of the medians.
+    """
+    if len(windows['start']) == 0:
+        return windows
+    ids = windows['start'] // width
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(ids)) + 1))
+    count = np.add.reduceat(windows['count'], starts)
+    weighted = windows['count'] * windows['mean']
+    mean = np.add.reduceat(weighted, starts) / count
+    spread = windows['mean'] - np.repeat(mean, np.diff(
+                np.concatenate((starts, [len(ids)]))))
+
+    merged = {'start': ids[starts] * width,
+              'count': count,
+              'mean': mean,
+              'm2': np.add.reduceat(windows['m2'] +
+                                    windows['count'] * spread * spread, starts),
+              'min': np.minimum.reduceat(windows['min'], starts),
+              'max': np.maximum.reduceat(windows['max'], starts)}
+    if 'median' in windows:
+        merged['median'] = np.add.reduceat(windows['count'] *
+                                           windows['median'], starts) / count
+    return merged
+
+
+def concat_windows(parts):
+    return dict((f, np.concatenate([p[f] for p in parts])) for f in parts[0])
+
+
+def build_levels(windows, width):
+    """
+    Levels of a TimeSummary: windows, then windows merged two by two (width
+    doubling at each level) up to a single window.
+    """
+    levels = [windows]
+    while len(levels[-1]['start']) > 1:
+        levels.append(merge_windows(levels[-1], width << len(levels)))
+    return levels
+
+
+
+class WindowAggregator(object):
+    """
+    Streaming time window aggregation of a time series, fed chunk by chunk so
+    the data never needs to be in memory at once:
+
+        agg = WindowAggregator('5Min', name='rtt')
+        for chunk in DataLoader(path).iter_chunks(DataRadclock):
+            agg.update(chunk.rtt(), chunk.data['time'])
+        agg.result()    # count, mean, std, min, max, median per window
+        agg.summary()   # multi-resolution TimeSummary for tseries
+
+    Each chunk is aggregated in one vectorized pass. Rows of the last window
+    of a chunk are kept until the window is complete, so memory is bounded by
+    the chunk and window sizes, and medians of windows are exact. Values also
+    go through a QuantileSketch for the percentiles of the whole series.
+    """
+
+    def __init__(self, window, name=None):
+        self.width = window_width(window)
+        self.name = name
+        self.parts = list()
+        self.last = None  # stamps and values of the open window
+        self.sketch = QuantileSketch()
+
+
+    def update(self, ts, stamps=None):
+        """
+        Add a chunk, following the previous one in time. ts is a Series with a
+        DatetimeIndex, or any values with their stamps (datetime or int64
+        nanoseconds), eg. the 'time' column of a loaded container.
+        """
+        if stamps is None:
+            if not isinstance(ts.index, pd.DatetimeIndex):
+                print 'Data passed to WindowAggregator has no time index'
+                raise exceptions.TypeError
+            stamps = ts.index.asi8
+        else:
+            stamps = pd.DatetimeIndex(stamps).asi8
+        values = np.asarray(ts.values, dtype=np.float64)
+        if self.name is None:
+            self.name = getattr(ts, 'name', None)
+        if self.last is not None:
+            if len(stamps) > 0 and stamps[0] < self.last[0][-1]:
+                print 'Chunks passed to WindowAggregator are not in time order'
+                raise exceptions.ValueError
+            stamps = np.concatenate((self.last[0], stamps))
+            values = np.concatenate((self.last[1], values))
+        self.sketch.update(np.asarray(ts))
+        if len(stamps) == 0:
+            return
+
+        # Keep the open window for the next chunk
+        split = np.searchsorted(stamps, stamps[-1] // self.width * self.width)
+        self.last = (stamps[split:], values[split:])
+        self.parts.append(aggregate_windows(stamps[:split], values[:split],
+                                            self.width))
+
+
+    def windows(self):
+        """
+        Aggregates of all windows seen so far as a dict of arrays (see
+        FIELDS), the last one possibly incomplete.
+        """
+        parts = list(self.parts)
+        if self.last is not None:
+            parts.append(aggregate_windows(self.last[0], self.last[1],
+                                           self.width))
+        if len(parts) == 0:
+            return aggregate_windows([], [], self.width)
+        return concat_windows(parts)
+
+
+    def result(self):
+        """
+        DataFrame of count, mean, std, min, max and median per window, indexed
+        by window start. Empty windows are not listed.
+        """
+        return windows_frame(self.windows())
+
+
+    def summary(self):
+        return TimeSummary(build_levels(self.windows(), self.width),
+                           self.width, self.name, self.sketch)
+
+
+
+def windows_frame(windows):
+    """
+    DataFrame of window aggregates indexed by window start.
+    """
+    index = pd.to_datetime(windows['start'], utc=True)
+    data = pd.DataFrame(index=index)
+    data['count'] = windows['count']
+    data['mean'] = windows['mean']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        data['std'] = np.sqrt(windows['m2'] / (windows['count'] - 1))
+    data['min'] = windows['min']
+    data['max'] = windows['max']
+    if 'median' in windows:
+        data['median'] = windows['median']
+    return data
+
+
+
+class TimeSummary(object):
+    """
+    Multi-resolution summary of a time series: level 0 holds the aggregates of
+    windows of width nanoseconds, level k of windows 2**k wider, up to a
+    single window (see build_levels()). Levels are dicts of arrays, possibly
+    memory mapped (see Pyramid), with a median or not. Size is at most twice
+    the size of level 0. select() returns
+    the level giving about one window per pixel over a time range, so drawing
+    any zoom level costs the same (see tseries()). stats() makes it usable
+    with custom_stats(), percentiles coming from sketch (anything with a
+    quantile() method, eg. a QuantileSketch of the values) if given, or
+    approximated from the medians of level 0 windows.
+    """
+
+    def __init__(self, levels, width, name=None, sketch=None):
+        self.levels = levels
+        self.width = width
+        self.name = name
+        self.sketch = sketch
+
+
+    def span(self):
+        """
+        Start and end of data (int64 nanoseconds).
+        """
+        starts = self.levels[0]['start']
+        if len(starts) == 0:
+            return 0, 0
+        return starts[0], starts[-1] + self.width
+
+
+    def level_for(self, t0, t1, points):
+        """
+        Coarsest level with at least points windows in [t0, t1).
+        """
+        windows = (t1 - t0) / float(self.width * max(points, 1))
+        if windows <= 1:
+            return 0
+        return min(int(math.floor(math.log(windows, 2))),
+                   len(self.levels) - 1)
+
+
+    def select(self, t0, t1, points):
+        """
+        Windows of the level matching points windows in [t0, t1) (int64
+        nanoseconds), as a dict of arrays, with the windows around the range
+        so lines reach the edges. Returns the windows and their width.
+        """
+        level = self.level_for(t0, t1, points)
+        width = self.width << level
+        windows = self.levels[level]
+        first, last = np.searchsorted(windows['start'], [t0 - width, t1])
+        first = max(first - 1, 0)
+        last = min(last + 1, len(windows['start']))
+        return dict((f, windows[f][first:last]) for f in windows), width
+
+
+    def frame(self, level=0):
+        return windows_frame(self.levels[level])
+
+
+    def stats(self, percentiles):
+        """
+        Same output as common.column_stats(): count, mean, std, min,
+        percentiles and max.
+        """
+        top = self.levels[-1]
+        if len(top['count']) == 0:
+            return [0] + [np.nan] * (len(percentiles) + 4)
+        count = top['count'][0]
+        std = np.nan
+        if count > 1:
+            std = math.sqrt(top['m2'][0] / (count - 1))
+
+        q = np.asarray(percentiles) / 100.0
+        if self.sketch is not None:
+            ptiles = self.sketch.quantile(q)
+        else:
+            base = self.levels[0]
+            values = base.get('median', base['mean'])
+            order = np.argsort(values, kind='mergesort')
+            ranks = np.cumsum(base['count'][order])
+            pos = np.searchsorted(ranks, q * count)
+            ptiles = values[order][np.minimum(pos, len(order) - 1)]
+        return [count, top['mean'][0], std, top['min'][0]] + list(ptiles) + \
+               [top['max'][0]]
+
+
+
+def resample(df, window, how='median'):
+    """
+    Aggregate Series or DataFrame columns by time windows (see
+    aggregate_windows()), keeping the aggregate how ('count', 'mean', 'std',
+    'min', 'max' or 'median'), the only one computed. Windows with no data are
+    kept as NaN (0 for 'count') so that gaps show when drawn, and the index
+    has the timezone of the df index. Columns are joined on window start.
+    """
+    if isinstance(df, pd.Series):
+        if not isinstance(df.index, pd.DatetimeIndex):
+            print 'Data passed to resample has no time index'
+            raise exceptions.TypeError
+        width = window_width(window)
+        fields = {'count': (), 'std': ('mean', 'm2')}.get(how, (how,))
+        windows = aggregate_windows(df.index.asi8, df.values, width, fields)
+        if how == 'std':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                values = np.sqrt(windows['m2'] / (windows['count'] - 1))
+        else:
+            values = windows[how]
+
+        # Every window between the first and the last stamp
+        start = windows['start']
+        if len(df) > 0:
+            first, last = df.index.asi8[[0, -1]] // width * width
+            data = np.empty((last - first) // width + 1,
+                            dtype=values.dtype if how == 'count' else float)
+            data.fill(0 if how == 'count' else np.nan)
+            data[(start - first) // width] = values
+            values = data
+            start = np.arange(first, last + width, width)
+        index = pd.DatetimeIndex(start, tz='UTC')
+        return pd.Series(values, index=index.tz_convert(df.index.tz),
+                         name=df.name)
+
+    columns = list()
+    for name in df.columns:
+        if df[name].dtype.kind in 'fiu':
+            columns.append(resample(df[name], window, how))
+    return pd.concat(columns, axis=1)
@@ -0,0 +1,173 @@
+#/usr/bin/env python
+#
+# ------------------------------------------------------------------------------
+# Copyright (c) 2012, Matt Davis  <matt@synclab.org>
+# Copyright (c) 2012, Julien Ridoux <julien@synclab.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ------------------------------------------------------------------------------
+
+import math
+import numpy as np
+
+
+class QuantileSketch(object):
+    """
+    Mergeable approximate quantiles (KLL sketch) for data that does not fit in
+    memory, eg. RTT of all hosts of a fleet:
+
+        sketch = QuantileSketch()
+        for chunk in DataLoader(path).iter_chunks(DataRadclock):
+            sketch.update(chunk.rtt())
+        fleet.merge(sketch)
+        custom_stats(fleet, ptile_range)
+
+    Values are kept in levels, an item at level h standing for 2**h values.
+    When a level is full it is sorted and every other item is promoted to the
+    next level. Memory is O(k) and the rank error is about 1.7/k (k=200 gives
+    ~1%). Count, mean, std, min and max are exact.
+    """
+
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared deviations from the mean
+        self.min = np.nan
+        self.max = np.nan
+        self._levels = list()
+        self._random = np.random.RandomState(seed)
+
+
+    def update(self, values):
+        """
+        Add a chunk of values (array or Series), NaN are ignored.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+
+        deviations = values - values.mean()
+        self._add_moments(len(values), values.mean(),
+                          np.dot(deviations, deviations),
+                          values.min(), values.max())
+        if len(self._levels) == 0:
+            self._levels.append(values)
+        else:
+            self._levels[0] = np.concatenate((self._levels[0], values))
+        self._compress()
+
+
+    def merge(self, other):
+        """
+        Merge other sketch into this one (eg. sketches of different files or
+        hosts).
+        """
+        if other.count == 0:
+            return
+        self._add_moments(other.count, other.mean, other.m2, other.min,
+                          other.max)
+        self.k = min(self.k, other.k)
+        for h, items in enumerate(other._levels):
+            if h == len(self._levels):
+                self._levels.append(items.copy())
+            else:
+                self._levels[h] = np.concatenate((self._levels[h], items))
+        self._compress()
+
+
+    def quantile(self, q):
+        """
+        Approximate quantile(s) q, with q in [0, 1].
+        """
+        q = np.asarray(q, dtype=np.float64)
+        if self.count == 0:
+            return q * np.nan
+
+        items = np.concatenate(self._levels)
+        weights = np.concatenate([np.repeat(2.0**h, len(level))
+                                  for h, level in enumerate(self._levels)])
+        order = np.argsort(items, kind='mergesort')
+        items = items[order]
+        ranks = np.cumsum(weights[order])
+
+        pos = np.searchsorted(ranks, q * ranks[-1], side='left')
+        result = items[np.minimum(pos, len(items) - 1)]
+        # Extremes are known exactly
+        result = np.where(q <= 0, self.min, result)
+        return np.where(q >= 1, self.max, result)
+
+
+    def stats(self, percentiles):
+        """
+        Same output as common.column_stats(): count, mean, std, min,
+        percentiles and max.
+        """
+        if self.count == 0:
+            return [0] + [np.nan] * (len(percentiles) + 4)
+        if self.count > 1:
+            std = math.sqrt(self.m2 / (self.count - 1))
+        else:
+            std = np.nan
+        ptiles = self.quantile(np.asarray(percentiles) / 100.0)
+        return [self.count, self.mean, std, self.min] + list(ptiles) + \
+               [self.max]
+
+
+    def _add_moments(self, count, mean, m2, vmin, vmax):
+        """
+        Combine running moments (Chan et al. parallel algorithm).
+        """
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min = np.nanmin([self.min, vmin])
+        self.max = np.nanmax([self.max, vmax])
+
+
+    def _capacity(self, h):
+        depth = len(self._levels) - 1 - h
+        return max(2, int(math.ceil(self.k * (2 / 3.0)**depth)))
+
+
+    def _compress(self):
+        """
+        Compact levels over capacity until all fit.
+        """
+        while True:
+            for h in range(len(self._levels)):
+                if len(self._levels[h]) > self._capacity(h):
+                    break
+            else:
+                return
+
+            if h + 1 == len(self._levels):
+                self._levels.append(np.zeros(0))
+            items = np.sort(self._levels[h])
+            odd = len(items) % 2
+            offset = self._random.randint(2)
+            promoted = items[offset:len(items) - odd:2]
+            self._levels[h] = items[len(items) - odd:]
+            self._levels[h+1] = np.concatenate((self._levels[h+1], promoted))
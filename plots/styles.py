@@ -55,13 +55,15 @@ class PlotStyles(object):
     def valid_for_data(self, data):
         '''
         Check that style dictionary keys match a dataframe column or series
-        name.
+        name (or name of other named data, eg. HistCounts).
         '''
         # Get keys of data as series or column names
         if isinstance(data, pd.Series):
             dkeys = set([data.name])
         elif isinstance(data, pd.DataFrame):
             dkeys = set(data.columns)
+        elif hasattr(data, 'name'):
+            dkeys = set([data.name])
         else:
             raise exceptions.TypeError
 
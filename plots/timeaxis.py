@@ -0,0 +1,104 @@
+#/usr/bin/env python
+#
+# ------------------------------------------------------------------------------
+# Copyright (c) 2012, Matt Davis  <matt@synclab.org>
+# Copyright (c) 2012, Julien Ridoux <julien@synclab.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ------------------------------------------------------------------------------
+
+import numpy as np
+
+from datetime import datetime as dtime
+from matplotlib.ticker import Formatter, Locator
+
+
+# Tick steps in nanoseconds: 1-2-5 below the second, then steps that read well
+# on a clock
+SECOND = 10**9
+STEPS = [m * 10**e for e in range(0, 9) for m in (1, 2, 5)] + \
+        [s * SECOND for s in (1, 2, 5, 10, 15, 30, 60, 120, 300, 600, 900,
+                              1800, 3600, 2*3600, 3*3600, 6*3600, 12*3600,
+                              86400, 2*86400, 7*86400, 14*86400, 28*86400)]
+
+
+class StampLocator(Locator):
+    """
+    Ticks for an axis of UNIX stamps in int64 nanoseconds (plotted as is, no
+    conversion to matplotlib dates). Steps are picked from STEPS to get about
+    nticks ticks, and aligned on multiples of the step since the epoch (UTC).
+    """
+
+    def __init__(self, nticks=6):
+        self.nticks = nticks
+
+
+    def __call__(self):
+        vmin, vmax = self.axis.get_view_interval()
+        return self.tick_values(vmin, vmax)
+
+
+    def tick_values(self, vmin, vmax):
+        vmin = float(vmin)
+        vmax = float(vmax)
+        if vmax < vmin:
+            vmin, vmax = vmax, vmin
+        span = vmax - vmin
+        for step in STEPS:
+            if span / step <= self.nticks:
+                break
+        else:
+            step = int(np.ceil(span / self.nticks / STEPS[-1])) * STEPS[-1]
+        first = int(np.ceil(vmin / step))
+        last = int(np.floor(vmax / step))
+        return np.arange(first, last + 1, dtype=np.float64) * step
+
+
+
+class StampFormatter(Formatter):
+    """
+    Labels for StampLocator ticks, with the precision the tick step needs.
+    """
+
+    def __call__(self, x, pos=None):
+        step = SECOND
+        if len(self.locs) > 1:
+            step = np.diff(self.locs).min()
+
+        # Round to the resolution of the step, stamps plotted as float64 are
+        # only precise to a few hundred nanoseconds
+        digits = 0
+        if step < SECOND:
+            digits = 9 - int(np.floor(np.log10(step * 1.01)))
+        resolution = 10**(9 - digits)
+        stamp = int(round(x / resolution)) * resolution
+        seconds, nanos = divmod(stamp, SECOND)
+        date = dtime.utcfromtimestamp(seconds)
+
+        if step >= 86400 * SECOND:
+            return date.strftime('%Y-%m-%d')
+        if step >= 60 * SECOND:
+            return date.strftime('%m-%d %H:%M')
+        if step >= SECOND:
+            return date.strftime('%H:%M:%S')
+        return date.strftime('%H:%M:%S') + '.%0*d' % (digits,
+                                                     nanos // resolution)
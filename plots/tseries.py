@@ -27,40 +27,192 @@
 # ------------------------------------------------------------------------------
 
 import exceptions
+import math
 import pandas as pd
+import numpy as np
 import matplotlib.pyplot as plt
 
+from matplotlib import rcParams
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
+from matplotlib.transforms import Affine2D
+
 from common import *
+from resample import resample, TimeSummary
 from styles import *
+from timeaxis import StampLocator, StampFormatter
+
+
+
+# Need to calibrate MAXSIZE
+MAXSIZE = 2000
+
+
+# -----------------------------------------------------------------------------
+# Envelope preserving down-sampling
+# -----------------------------------------------------------------------------
+def envelope_sample(df, buckets):
+    """
+    M4 down-sampling: split the series in buckets of equal number of points,
+    and keep the first, last, min and max points of each bucket (for all
+    columns of a DataFrame). Unlike range sampling, spikes and outliers are
+    kept and the plotted envelope looks the same as with the full data.
+    Works on the raw numpy arrays, one vectorized pass per column.
+    """
+    size = len(df)
+    if buckets <= 0 or size <= 4 * buckets:
+        return df
+
+    width = int(math.ceil(size / float(buckets)))
+    buckets = int(math.ceil(size / float(width)))
+    starts = np.arange(buckets) * width
+    keep = [starts, np.minimum(starts + width, size) - 1]
+
+    if isinstance(df, pd.Series):
+        columns = [df.values]
+    else:
+        columns = [df[col].values for col in df.columns]
+
+    for values in columns:
+        if values.dtype.kind not in 'fiu':
+            continue
+        values = values.astype(np.float64)
+        missing = np.isnan(values)
+
+        # Pad last bucket with values never selected, NaN are ignored
+        pad = buckets * width - size
+        low = np.concatenate((np.where(missing, np.inf, values),
+                              np.repeat(np.inf, pad)))
+        high = np.concatenate((np.where(missing, -np.inf, values),
+                               np.repeat(-np.inf, pad)))
+        keep.append(starts + low.reshape(buckets, width).argmin(axis=1))
+        keep.append(starts + high.reshape(buckets, width).argmax(axis=1))
+
+    keep = np.unique(np.concatenate(keep))
+    return df.iloc[keep[keep < size]]
+
+
+def group_envelope(df, groups):
+    """
+    M4 down-sampling over buckets of any size: groups gives the bucket number
+    of each row (non decreasing). Returns the positions of the first, last,
+    min and max rows of each bucket, for all numeric columns. The envelope of
+    envelopes being the envelope of the data, this merges buckets that were
+    already down-sampled.
+    """
+    groups = np.asarray(groups)
+    if len(groups) == 0:
+        return np.zeros(0, dtype=np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(groups)) + 1))
+    return bucket_envelope(df, starts)
+
+
+def bucket_envelope(df, starts):
+    """
+    Same as group_envelope(), buckets being given by the position of their
+    first row (increasing, starting at 0). Rows of a bucket are contiguous, so
+    extrema come from reduceat() and their first row from one comparison: a
+    few vectorized passes per column, no sort.
+    """
+    size = len(df)
+    starts = np.asarray(starts, dtype=np.int64)
+    counts = np.diff(np.concatenate((starts, [size])))
+    keep = [starts, starts + counts - 1]
+
+    if isinstance(df, pd.Series):
+        columns = [df.values]
+    else:
+        columns = [df[col].values for col in df.columns]
+
+    def first_match(values, extremes):
+        found = np.flatnonzero(values == np.repeat(extremes, counts))
+        bucket = np.searchsorted(starts, found, side='right')
+        first = np.concatenate(([True], np.diff(bucket) != 0))
+        return found[first]
+
+    for values in columns:
+        if values.dtype.kind not in 'fiu':
+            continue
+        values = values.astype(np.float64, copy=False)
+        missing = np.isnan(values)
+        # NaN are never selected, unless the whole bucket is NaN
+        if missing.any():
+            low = np.where(missing, np.inf, values)
+        else:
+            low = values
+        keep.append(first_match(low, np.minimum.reduceat(low, starts)))
+        if missing.any():
+            low = np.where(missing, -np.inf, values)
+        keep.append(first_match(low, np.maximum.reduceat(low, starts)))
+        del low, missing
+
+    return np.unique(np.concatenate(keep))
+
+
+def pixel_sample(df, pixels):
+    """
+    M4 down-sampling on pixel columns: rows are grouped by the pixel column
+    their x value falls in, over the data range drawn on pixels columns, and
+    the first, last, min and max rows of each column are kept (see
+    bucket_envelope()). A line drawn over these columns then covers the same
+    pixels as with the full data. Falls back to envelope_sample() if the
+    index is not increasing numbers or stamps.
+    """
+    size = len(df)
+    pixels = int(math.ceil(pixels))
+    if pixels <= 0 or size <= 4 * pixels:
+        return df
+
+    index = df.index
+    if isinstance(index, pd.DatetimeIndex):
+        x = index.asi8
+    elif index.dtype.kind in 'fiu':
+        x = np.asarray(index, dtype=np.float64)
+    else:
+        return envelope_sample(df, pixels)
+    span = float(x[-1] - x[0])
+    if not index.is_monotonic_increasing or span <= 0:
+        return envelope_sample(df, pixels)
+
+    # First row of each pixel column, by bisection of the sorted x values
+    edges = x[0] + span * np.arange(1, pixels) / pixels
+    if x.dtype.kind == 'i':
+        edges = np.ceil(edges).astype(np.int64)
+    starts = np.unique(np.concatenate(([0], np.searchsorted(x, edges))))
+    return df.iloc[bucket_envelope(df, starts[starts < size])]
 
 
 
 # -----------------------------------------------------------------------------
 # Compute down-sampling interval
 # -----------------------------------------------------------------------------
-def sample_data(df, sampling, path):
+def sample_data(df, sampling, path, pixels=None):
     """
     Heuristic to Sample DataFrame or TimeSeries. If aim at saving in a
     rasterized format, delegate the job to the renderer. Otherwise, cap number
-    of points to something reasonable.
+    of points to something reasonable, keeping the min/max envelope of each
+    of the pixels columns of the axes (see pixel_sample()), MAXSIZE / 4
+    columns if not known.
     If sampling is not None, heuristic is overwritten. If sampling is a scalar,
-    ends up with deterministic sampling (1/sampling). If sampling is a string,
-    the output is binned in time windows (sampling='5Min'), which may not
-    reflects data density (all bins end up with one or zero points).
+    ends up with deterministic sampling (1/sampling). If sampling is 'm4', the
+    envelope down-sampling is used even for rasterized formats. If sampling is
+    any other string, the output is the median of time windows
+    (sampling='5Min', see resample()), which may not reflects data density
+    (all bins end up with one or zero points).
     This function returns a copy of the df passed to it.
     """
 
     idx = df.index
+    if pixels is None:
+        pixels = MAXSIZE / 4
 
     # The user rules, if sampling is an integer, do range sampling, otherwise
     # assumes we do timeseries sampling
     if sampling != None:
-        if isinstance(sampling, str):
-            data = df.resample(sampling, how='median')
-            # Not quite sure why name is not kept in the case of a Series. Seems
-            # pandas converts one column dataframe into series
-            if isinstance(data, pd.Series):
-                data.name = df.name
+        if sampling == 'm4':
+            data = pixel_sample(df, pixels)
+        elif isinstance(sampling, str):
+            data = resample(df, sampling)
         elif isinstance(sampling, int):
             # Check if sampling disabled.
             if sampling == 0:
@@ -80,13 +232,9 @@ def sample_data(df, sampling, path):
     if path == None or path.lower().endswith(vector_fmt_extensions):
         autosample = True
 
-    # Need to calibrate MAXSIZE
-    MAXSIZE = 2000
-    size = df.count().max()
-    if autosample == True and size > MAXSIZE:
-        sampling = int(size / MAXSIZE)
-        idx = range(0, size, sampling)
-        data = df.ix[idx]
+    # Each pixel column gives up to 4 points per data column
+    if autosample == True:
+        data = pixel_sample(df, pixels)
     else:
         data = df
 
@@ -94,23 +242,130 @@ def sample_data(df, sampling, path):
 
 
 
+# -----------------------------------------------------------------------------
+# Fast drawing backend
+# -----------------------------------------------------------------------------
+def draw_lines(ax, df, scale=1, styles=None, transparency=0.3):
+    """
+    Draw all columns of a Series or DataFrame on ax as a single LineCollection
+    instead of one pandas plot per column. Data is not copied to be scaled,
+    scale is part of the collection transform. A DatetimeIndex is plotted as
+    int64 nanoseconds, with StampLocator and StampFormatter ticks, which skips
+    the pandas date conversions. Columns styled with markers (eg. 'g.') are
+    drawn with ax.plot(). Returns the collection.
+    """
+    legend = isinstance(df, pd.DataFrame)
+    if isinstance(df, pd.Series):
+        df = df.to_frame()
+    columns = [c for c in df.columns if df[c].dtype.kind in 'fiu']
+
+    if isinstance(df.index, pd.DatetimeIndex):
+        x = df.index.asi8
+        ax.xaxis.set_major_locator(StampLocator())
+        ax.xaxis.set_major_formatter(StampFormatter())
+    else:
+        x = np.asarray(df.index, dtype=np.float64)
+    transform = Affine2D().scale(1, scale) + ax.transData
+
+    # All columns share one array of vertices
+    verts = np.empty((len(columns), len(df), 2))
+    verts[:, :, 0] = x
+    cycle = rcParams['axes.prop_cycle'].by_key()['color']
+    segments = list()
+    colors = list()
+    linestyles = list()
+    handles = list()
+    for i, name in enumerate(columns):
+        verts[i, :, 1] = df[name].values
+        color = cycle[i % len(cycle)]
+        style = '-'
+        if styles != None:
+            color = styles.color_for_name(name)
+            style = styles.linestyle_for_name(name)[len(color):] or '-'
+
+        if style in ('-', '--', '-.', ':'):
+            segments.append(verts[i])
+            colors.append(color)
+            linestyles.append(style)
+            handles.append(Line2D([], [], color=color, linestyle=style,
+                                  alpha=transparency, label=name))
+        else:
+            line, = ax.plot(verts[i, :, 0], verts[i, :, 1], style,
+                            color=color, alpha=transparency,
+                            transform=transform, label=name)
+            handles.append(line)
+
+    lines = LineCollection(segments, colors=colors, linestyles=linestyles,
+                           alpha=transparency, transform=transform)
+    ax.add_collection(lines, autolim=False)
+    if len(x) > 0:
+        ax.set_xlim(x[0], x[-1])
+    if legend:
+        ax.legend(handles=handles, loc='best')
+    return lines
+
+
+def draw_summary(ax, summary, scale=1, color='b', transparency=0.3,
+                 trange=None):
+    """
+    Draw a TimeSummary on ax as the median (or mean) of windows within their
+    min/max band, on a nanosecond time axis, over trange (start and end as
+    Timestamps, strings or int64 nanoseconds) or the whole summary. The
+    summary level gives about one window per pixel of the axes, and is picked
+    again when the x range changes, so any zoom draws at the same cost.
+    Returns the median line.
+    """
+    transform = Affine2D().scale(1, scale) + ax.transData
+    line, = ax.plot([], [], '-', color=color, transform=transform,
+                    label=summary.name)
+    band = [None]
+    ax.xaxis.set_major_locator(StampLocator())
+    ax.xaxis.set_major_formatter(StampFormatter())
+
+    def update(ax):
+        t0, t1 = ax.get_xlim()
+        windows, width = summary.select(t0, t1, ax.bbox.width)
+        x = windows['start'] + width / 2
+        line.set_data(x, windows.get('median', windows['mean']))
+        if band[0] is not None:
+            band[0].remove()
+        band[0] = ax.fill_between(x, windows['min'], windows['max'],
+                                  color=color, alpha=transparency,
+                                  linewidth=0, transform=transform)
+
+    if trange is None:
+        t0, t1 = summary.span()
+    else:
+        t0, t1 = [pd.Timestamp(t).value for t in trange]
+    ax.set_xlim(t0, max(t1, t0 + 1))
+    update(ax)
+    ax.callbacks.connect('xlim_changed', update)
+    return line
+
+
+
 # -----------------------------------------------------------------------------
 # Plot timeseries
 # -----------------------------------------------------------------------------
 def tseries(df, styles=None, ax=None, title='Title',
         transparency=0.3,
         xlabel='Xlabel', ylabel='Ylabel', path=None,
-        ptile_range=(1,99), sampling=None):
+        ptile_range=(1,99), sampling=None, fast=False, trange=None):
     """
     Takes a pandas.Series or pandas.DataFrame timeseries as input and plot.
-    sampling can be an integer or a time period such as '5Min'. If sampling is
-    0, auto-sampling is disabled.
+    A TimeSummary (see WindowAggregator and Pyramid) is drawn with
+    draw_summary() over trange, data never needs to be loaded at once.
+    sampling can be an integer, 'm4' or a time period such as '5Min'. If
+    sampling is 0, auto-sampling is disabled.
     styles parameter takes precedence over color and transparency.
+    If fast is True, data is drawn with draw_lines(): one LineCollection for
+    all columns, no scaled copy and a nanosecond time axis.
     """
 
     # Test that ts is a pandas DataFrame object
     if (not isinstance(df, pd.Series) and
-        not isinstance(df, pd.DataFrame)):
+        not isinstance(df, pd.DataFrame) and
+        not isinstance(df, TimeSummary)):
         print "Data passed to tseries is not a pandas object"
         raise exceptions.TypeError
 
@@ -131,11 +386,6 @@ def tseries(df, styles=None, ax=None, title='Title',
     # Scale stats
     # scaledstats = stats * scale
 
-    # Sample data to save resources. Note that the stats are computed on full
-    # dataset.
-    # NOTE: that this requires pandas >= 0.9 to work.
-    plot_data = sample_data(df, sampling, path)
-
     # Get reasonable figure and axis
     # NOTE: saving to a file takes precedence on axis being specified
     # TODO: xlabels are cut off when specifying dimensions???
@@ -143,20 +393,42 @@ def tseries(df, styles=None, ax=None, title='Title',
         fig = plt.figure(figsize=(8.0, 3.0)) # in inches!
         ax = fig.gca()
     else:
-        fig = plt.gcf()
+        fig = ax.figure
+
+    # Sample data to save resources, down to pixel columns. The axes are
+    # resized by tight_layout() below, so buckets are half a pixel of the
+    # figure at the saving resolution, whatever the final axes width. Note that
+    # the stats are computed on full dataset.
+    # NOTE: that this requires pandas >= 0.9 to work.
+    if isinstance(df, TimeSummary):
+        plot_data = df
+    else:
+        dpi = rcParams['savefig.dpi']
+        if dpi == 'figure':
+            dpi = fig.dpi
+        pixels = 2 * fig.get_figwidth() * max(dpi, fig.dpi)
+        plot_data = sample_data(df, sampling, path, pixels)
 
     # Plot all timeseries
     # if plot_data is timeseries, style has to be a string
     linestyle = None
     if styles != None:
-        if isinstance(plot_data, pd.Series):
+        if not isinstance(plot_data, pd.DataFrame):
             linestyle = styles.linestyle_for_name(plot_data.name)
         else:
             linestyle = styles.linestyles()
 
-    (plot_data * scale).plot(ax=ax,
-            style=linestyle,
-            alpha=transparency)
+    if isinstance(plot_data, TimeSummary):
+        color = 'b'
+        if styles != None:
+            color = styles.color_for_name(plot_data.name)
+        draw_summary(ax, plot_data, scale, color, transparency, trange)
+    elif fast == True:
+        draw_lines(ax, plot_data, scale, styles, transparency)
+    else:
+        (plot_data * scale).plot(ax=ax,
+                style=linestyle,
+                alpha=transparency)
 
     # Esthetics
     ax.grid(which='major', axis='both')
@@ -170,9 +442,10 @@ def tseries(df, styles=None, ax=None, title='Title',
     else:
         fig.tight_layout()
 
-    # Saving on file
+    # Saving on file, the figure is not needed anymore
     if path != None:
         fig.savefig(path)
+        plt.close(fig)
 
     return stats
 
@@ -0,0 +1,207 @@
+#/usr/bin/env python
+#
+# ------------------------------------------------------------------------------
+# Copyright (c) 2012, Matt Davis  <matt@synclab.org>
+# Copyright (c) 2012, Julien Ridoux <julien@synclab.org>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# ------------------------------------------------------------------------------
+
+"""
+Allan variance engines against a brute-force implementation of the
+definitions. Run from the top directory:
+
+    python -m unittest discover tests
+"""
+
+import unittest
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import pandas as pd
+
+from plots.allanvar import *
+
+
+def reference_allanvar(values, scale, smoothed=True):
+    """
+    Allan variance from averages of scale samples, computed one by one: all
+    origins if smoothed (overlapping), every scale samples otherwise.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    step = 1 if smoothed else scale
+    squares = list()
+    for start in range(0, len(values) - 2 * scale + 1, step):
+        first = values[start:start + scale].mean()
+        second = values[start + scale:start + 2 * scale].mean()
+        squares.append((second - first) ** 2)
+    if len(squares) == 0:
+        return np.nan
+    return sum(squares) / len(squares) / 2
+
+
+def reference_gap_allanvar(values, valid, scale):
+    """
+    Overlapping Allan and modified Allan variances of values on a regular
+    grid, keeping only terms whose samples are all valid. Returns the
+    variances and their number of terms.
+    """
+    avar = list()
+    for start in range(len(values) - 2 * scale + 1):
+        if valid[start:start + 2 * scale].all():
+            first = values[start:start + scale].mean()
+            second = values[start + scale:start + 2 * scale].mean()
+            avar.append((second - first) ** 2)
+    mvar = list()
+    for start in range(len(values) - 3 * scale + 2):
+        if valid[start:start + 3 * scale - 1].all():
+            term = sum(values[k + scale] - values[k]
+                       for i in range(start, start + scale)
+                       for k in range(i, i + scale))
+            mvar.append(term ** 2)
+    a = np.mean(avar) / 2 if avar else np.nan
+    m = np.sum(mvar) / (2.0 * scale**4 * len(mvar)) if mvar else np.nan
+    return a, len(avar), m, len(mvar)
+
+
+def random_clock(size, seed=0):
+    """
+    Random walk plus white noise, around a large offset to check precision.
+    """
+    random = np.random.RandomState(seed)
+    return 1e3 + np.cumsum(random.randn(size)) * 1e-3 + random.randn(size)
+
+
+
+class TestComputeAllanvar(unittest.TestCase):
+
+    def check(self, values, timescales, variances, smoothed):
+        expected = [reference_allanvar(values, m, smoothed)
+                    for m in timescales]
+        np.testing.assert_allclose(variances, expected, rtol=1e-9)
+
+
+    def test_octaves(self):
+        values = random_clock(1000)
+        for smoothed in (True, False):
+            timescales, variances = compute_allanvar(values, smoothed)
+            self.assertEqual(list(timescales),
+                             list(octave_timescales(1000, smoothed)))
+            self.check(values, timescales, variances, smoothed)
+
+
+    def test_any_grid(self):
+        values = random_clock(777, seed=1)
+        for smoothed in (True, False):
+            grid = log_timescales(len(values), 30, smoothed)
+            timescales, variances = compute_allanvar(values, smoothed, grid)
+            self.check(values, timescales, variances, smoothed)
+
+
+    def test_chunks(self):
+        values = random_clock(1000, seed=2)
+        grid = [1, 2, 3, 7, 50, 300]
+        for smoothed in (True, False):
+            expected = compute_allanvar(values, smoothed, grid)[1]
+            for chunk in (1, 7, 64, 5000):
+                variances = compute_allanvar(values, smoothed, grid,
+                                             chunk)[1]
+                np.testing.assert_allclose(variances, expected, rtol=1e-12)
+
+
+    def test_too_large(self):
+        variances = compute_allanvar(random_clock(10), True, [1, 5, 6, 20])[1]
+        self.assertFalse(np.isnan(variances[:2]).any())
+        self.assertTrue(np.isnan(variances[2:]).all())
+
+
+    def test_nan_ignored(self):
+        values = random_clock(500, seed=3)
+        holes = values.copy()
+        holes[::10] = np.nan
+        np.testing.assert_allclose(compute_allanvar(holes)[1],
+                                   compute_allanvar(values[~np.isnan(holes)])[1])
+
+
+
+class TestAllanAccumulator(unittest.TestCase):
+
+    def test_chunks(self):
+        values = random_clock(3000, seed=4)
+        acc = AllanAccumulator()
+        for start in range(0, len(values), 333):
+            acc.update(values[start:start + 333])
+        timescales, variances = acc.compute_allanvar()
+        expected = compute_allanvar(values, smoothed=False)
+        self.assertEqual(list(timescales), list(expected[0]))
+        np.testing.assert_allclose(variances, expected[1], rtol=1e-9)
+
+
+
+class TestGapAllanvar(unittest.TestCase):
+
+    def test_gaps(self):
+        random = np.random.RandomState(5)
+        size = 400
+        values = random_clock(size, seed=5)
+        valid = random.rand(size) > 0.03
+        valid[100:130] = False
+        grid = pd.date_range('2012-10-01', periods=size, freq='16s', tz='UTC')
+        # Stamps off the grid by a few seconds still land on it
+        jitter = random.randint(-3, 4, size) * 10**9
+        index = pd.DatetimeIndex(grid.asi8[valid] + jitter[valid], tz='UTC')
+        ts = pd.Series(values[valid], index=index)
+
+        result = compute_gap_allanvar(ts, timescales=[1, 2, 3, 5, 16, 40, 200])
+        centered = values - values[valid].mean()
+        for m in result.index:
+            avar, avar_count, mvar, mvar_count = \
+                reference_gap_allanvar(centered, valid, m)
+            row = result.loc[m]
+            self.assertEqual(row['avar_count'], avar_count)
+            self.assertEqual(row['mvar_count'], mvar_count)
+            np.testing.assert_allclose([row['avar'], row['mvar']],
+                                       [avar, mvar], rtol=1e-9)
+            self.assertAlmostEqual(row['tau'], m * 16.0)
+
+
+    def test_regular(self):
+        values = random_clock(1000, seed=6)
+        for freq, period in (('300ms', 0.3), ('1500ms', 1.5)):
+            index = pd.date_range('2012-10-01', periods=len(values), freq=freq)
+            ts = pd.Series(values, index=index)
+            result = compute_gap_allanvar(ts)
+            np.testing.assert_allclose(result['avar'].values,
+                                       compute_allanvar(ts)[1], rtol=1e-9)
+            np.testing.assert_allclose(result['tau'].values,
+                                       result.index.values * period)
+
+
+    def test_null_period(self):
+        ts = pd.Series(np.ones(5), index=pd.DatetimeIndex([0, 0, 0, 0, 1]))
+        self.assertRaises(ValueError, compute_gap_allanvar, ts)
+
+
+
+if __name__ == '__main__':
+    unittest.main()